@@ -0,0 +1,335 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from scrape_data import (PARSER_BACKENDS, RetryPolicy, aiohttp, async_extract_value_from_url,
+                         async_process_urls, create_session, extract_value_from_url, parse_value_from_html,
+                         process_urls)
+
+
+def make_search_page(filler_blocks: int = 2000, variant: str = 'primary') -> str:
+    """
+    Builds a synthetic search result page of roughly the size and shape of the pages we scrape.
+
+    Args:
+        filler_blocks (int): The number of result blocks around the sidebar. Each adds about 250 bytes.
+        variant (str): 'primary' for a page with span#sidebar-title, 'fallback' for a page with only the qaselector
+            span, anything else for a page with neither.
+
+    Returns:
+        str: The page content.
+    """
+    block = ('<div class="result"><a href="/item/{0}"><img src="/img/{0}.jpg" alt="item {0}"></a>'
+             '<h2 class="title">Risultato numero {0}</h2><p class="desc">Descrizione &amp; dettagli</p>'
+             '<span class="price">{0},00 &euro;</span></div>\n')
+    half = filler_blocks // 2
+    if variant == 'primary':
+        sidebar = '<aside><span id="sidebar-title"> 1.234 <b>risultati</b> </span></aside>'
+    elif variant == 'fallback':
+        sidebar = '<aside><span qaselector="sidebar-result-counter">1.234 risultati</span></aside>'
+    else:
+        sidebar = '<aside><span class="sidebar-empty">Nessun risultato</span></aside>'
+    return ('<!DOCTYPE html><html><head><title>Ricerca</title></head><body>'
+            + ''.join(block.format(i) for i in range(half)) + sidebar
+            + ''.join(block.format(i) for i in range(half, filler_blocks)) + '</body></html>')
+
+
+# Pages on which the backends used to disagree: elements inside comments, scripts and styles, elements closed by
+# the end tag of their parent, and void elements
+EDGE_CASE_PAGES = [
+    '<!-- <span id="sidebar-title">OLD</span> --><span id="sidebar-title">NEW</span>',
+    '<script>var s = "<span id=\\"sidebar-title\\">JS</span>";</script><span id="sidebar-title">NEW</span>',
+    '<style>/* <span id="sidebar-title">CSS</span> */</style><span qaselector="sidebar-result-counter">fb</span>',
+    '<!-- unterminated <span id="sidebar-title">X</span>',
+    '<span id="sidebar-title">a<br>b<br/> c<img src="x">d</span>',
+    '<!-- nothing but a comment -->',
+]
+
+# Misnested pages, which 'strainer' does not close like the other backends (see parse_value_from_html)
+MISNESTED_PAGES = [
+    '<div><span id="sidebar-title">abc</div>more</body>',
+    '<p><span qaselector="sidebar-result-counter">a<b>b</p>c',
+]
+
+
+def benchmark_parsers(pages: List[str], repeat: int = 20) -> Dict[str, float]:
+    """
+    Measures the average time per page of every available parser backend, after checking that all of them
+    extract the same values from the pages and from EDGE_CASE_PAGES and MISNESTED_PAGES.
+
+    Args:
+        pages (List[str]): The pages to parse.
+        repeat (int): How many times every page is parsed per backend.
+
+    Returns:
+        Dict[str, float]: The average number of milliseconds per page, by backend name.
+    """
+    available = {}
+    for name in PARSER_BACKENDS:
+        try:
+            available[name] = [parse_value_from_html(page, name) for page in pages + EDGE_CASE_PAGES]
+        except ImportError as e:
+            print(f"Skipping '{name}': {e}")
+
+    reference = available.get('html.parser')
+    misnested = [parse_value_from_html(page, 'html.parser') for page in MISNESTED_PAGES]
+    for name, values in available.items():
+        if values != reference:
+            raise AssertionError(f"Parser backend '{name}' returned {values}, expected {reference}")
+        values = [parse_value_from_html(page, name) for page in MISNESTED_PAGES]
+        if name != 'strainer' and values != misnested:
+            raise AssertionError(f"Parser backend '{name}' returned {values}, expected {misnested}")
+
+    timings = {}
+    for name in available:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                parse_value_from_html(page, name)
+        timings[name] = (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+    return timings
+
+
+class StubServer:
+    """
+    A local HTTP server that serves synthetic search pages, so the fetch pipeline can be measured without touching
+    a real site. /page/<n> returns a 'primary', 'fallback' or 'missing' page (see make_search_page) by n modulo 3,
+    after waiting latency seconds. A share error_rate of the requests, chosen at random, fail with a 503 instead.
+    Use it as a context manager; url(n) returns the address of page n.
+
+    Args:
+        filler_blocks (int): The size of the pages, see make_search_page. Defaults to 500.
+        latency (float): The number of seconds every response is delayed. Defaults to 0.
+        error_rate (float): The share of requests answered with a 503. Defaults to 0.
+        seed (int): The seed of the error choice. Defaults to 42.
+    """
+
+    def __init__(self, filler_blocks: int = 500, latency: float = 0.0, error_rate: float = 0.0, seed: int = 42):
+        pages = {variant: make_search_page(filler_blocks, variant).encode('utf-8')
+                 for variant in ('primary', 'fallback', 'missing')}
+        variants = list(pages)
+        errors = random.Random(seed)
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                time.sleep(latency)
+                with lock:
+                    failed = errors.random() < error_rate
+                try:
+                    body = None if failed else pages[variants[int(self.path.rsplit('/', 1)[-1]) % 3]]
+                except ValueError:
+                    body = b''
+                self.send_response(503 if failed else 200 if body else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body or b'')))
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Streamed reads and finished runs drop their connections early
+                pass
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, n: int) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/page/{n}"
+
+    def __enter__(self) -> 'StubServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _fetch_latencies(urls: List[str], engine: str, parser: str, concurrency: int,
+                     retry_policy: RetryPolicy) -> List[float]:
+    """
+    Fetches the URLs with extract_value_from_url ('sync' one at a time, 'threads' with a thread pool) or
+    async_extract_value_from_url ('async'), and returns the time every URL took.
+    """
+    stream = parser == 'stream'
+    parser = 'html.parser' if stream else parser
+
+    if engine == 'async':
+        async def fetch_all() -> List[float]:
+            semaphore = asyncio.Semaphore(concurrency)
+            connector = aiohttp.TCPConnector(limit=concurrency)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                async def timed(url: str) -> float:
+                    async with semaphore:
+                        start = time.perf_counter()
+                        await async_extract_value_from_url(url, session, retry_policy=retry_policy, parser=parser,
+                                                           stream=stream)
+                        return time.perf_counter() - start
+                return await asyncio.gather(*(timed(url) for url in urls))
+        return asyncio.run(fetch_all())
+
+    with create_session(pool_maxsize=concurrency) as session:
+        def timed(url: str) -> float:
+            start = time.perf_counter()
+            extract_value_from_url(url, session=session, retry_policy=retry_policy, parser=parser, stream=stream)
+            return time.perf_counter() - start
+        if engine == 'sync':
+            return [timed(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(timed, urls))
+
+
+def _run_scenario(scenario: dict, results: 'multiprocessing.Queue') -> None:
+    """
+    Runs one benchmark scenario and puts its measurements on the queue. Meant to run in a process of its own, so
+    that CPU time and peak RSS belong to the scenario alone.
+    """
+    import logging
+    logging.getLogger().setLevel(logging.CRITICAL)
+    retry_policy = RetryPolicy(max_retries=scenario['max_retries'], base_delay=0.05, max_delay=0.5)
+    urls = scenario['urls']
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if scenario['end_to_end']:
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, 'urls.csv')
+            pd.DataFrame({'url': urls}).to_csv(input_file, index=False)
+            options = dict(requests_per_second=None, retry_policy=retry_policy, parser=scenario['parser'],
+                           extraction_cache_size=0)
+            if scenario['engine'] == 'async':
+                asyncio.run(async_process_urls(input_file, os.path.join(directory, 'out.csv'),
+                                               max_concurrency=scenario['concurrency'], **options))
+            else:
+                process_urls(input_file, os.path.join(directory, 'out.csv'),
+                             max_workers=1 if scenario['engine'] == 'sync' else scenario['concurrency'], **options)
+        latencies = []
+    else:
+        latencies = _fetch_latencies(urls, scenario['engine'], scenario['parser'], scenario['concurrency'],
+                                     retry_policy)
+    elapsed = time.perf_counter() - start
+    results.put({
+        'elapsed': elapsed,
+        'cpu': time.process_time() - cpu_start,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'latencies': latencies
+    })
+
+
+def _scenario_results(process: multiprocessing.Process, results: 'multiprocessing.Queue', timeout: float) -> dict:
+    """
+    Returns the measurements of a scenario process. Raises RuntimeError if the process exits without them or does not
+    deliver them within timeout seconds, in which case it is terminated.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        exited = process.exitcode is not None
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            # Checked before the last get, as the results may arrive just before the process exits
+            if exited:
+                raise RuntimeError(f"The benchmark scenario exited with code {process.exitcode} without results")
+    process.terminate()
+    raise RuntimeError(f"The benchmark scenario gave no results within {timeout} seconds")
+
+
+def benchmark_fetching(payload: dict) -> pd.DataFrame:
+    """
+    Measures fetch throughput against a StubServer for every engine and parser mode in the payload, each in a
+    fresh process.
+
+    Args:
+        payload (dict): The benchmark configuration: 'urls', 'filler_blocks', 'latency', 'error_rate',
+            'max_retries', 'concurrency', 'engines' ('sync', 'threads', 'async'), 'parsers' (PARSER_BACKENDS
+            names or 'stream'), 'end_to_end', which runs process_urls instead of timing single URLs, and
+            optionally 'scenario_timeout', the number of seconds a scenario may take (defaults to 600).
+
+    Returns:
+        pd.DataFrame: URLs/sec, p50/p95/p99 latency in ms, CPU seconds and peak RSS by engine and parser.
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    with StubServer(payload['filler_blocks'], payload['latency'], payload['error_rate']) as server:
+        urls = [server.url(n) for n in range(payload['urls'])]
+        for engine in payload['engines']:
+            if engine == 'async' and aiohttp is None:
+                print("Skipping 'async': aiohttp is not installed")
+                continue
+            for parser in payload['parsers']:
+                if payload['end_to_end'] and parser == 'stream':
+                    continue
+                results = context.Queue()
+                process = context.Process(target=_run_scenario, args=({
+                    'urls': urls, 'engine': engine, 'parser': parser, 'concurrency': payload['concurrency'],
+                    'max_retries': payload['max_retries'], 'end_to_end': payload['end_to_end']
+                }, results))
+                process.start()
+                try:
+                    measured = _scenario_results(process, results, payload.get('scenario_timeout', 600))
+                finally:
+                    process.join()
+                latencies = np.array(measured['latencies']) * 1000
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+                rows.append({'engine': engine, 'parser': parser,
+                             'urls_per_sec': len(urls) / measured['elapsed'],
+                             'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                             'cpu_s': measured['cpu'], 'peak_rss_mb': measured['peak_rss_mb']})
+    return pd.DataFrame(rows)
+
+
+def main(payload: dict) -> None:
+    """
+    Runs the benchmarks and prints the results.
+
+    Args:
+        payload (dict): A dictionary containing the configuration parameters.
+    """
+    pages = [make_search_page(payload['filler_blocks'], variant) for variant in ('primary', 'fallback', 'missing')]
+    print(f"Parsing {len(pages)} pages of ~{sum(map(len, pages)) // len(pages) // 1024} KB, "
+          f"{payload['repeat']} times each")
+
+    timings = benchmark_parsers(pages, payload['repeat'])
+    baseline = timings['html.parser']
+    for name, ms in timings.items():
+        print(f"{name:<14} {ms:8.2f} ms/page {baseline / ms:6.1f}x")
+
+    print(f"\nFetching {payload['urls']} URLs from a local server ({payload['latency'] * 1000:.0f} ms latency, "
+          f"{payload['error_rate']:.0%} errors, concurrency {payload['concurrency']})")
+    print(benchmark_fetching(payload).to_string(index=False, float_format=lambda value: f"{value:.1f}"))
+
+
+if __name__ == '__main__':
+    Payload = {
+        'filler_blocks': 500,
+        'repeat': 20,
+        'urls': 300,
+        'latency': 0.02,
+        'error_rate': 0.02,
+        'max_retries': 2,
+        'concurrency': 16,
+        'engines': ['sync', 'threads', 'async'],
+        'parsers': ['html.parser', 'lxml', 'targeted', 'stream'],
+        'end_to_end': False,
+        'scenario_timeout': 600
+    }
+    main(Payload)
@@ -1,33 +1,194 @@
+import numpy as np
 import pandas as pd
 import requests
+import asyncio
+import base64
+import codecs
+import gzip
+import hashlib
+import itertools
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import random
+import re
+import socket
+import sqlite3
+import tempfile
+import threading
+import uuid
 import time
-from bs4 import BeautifulSoup
-from typing import Optional
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from queue import Full, Queue
+from contextlib import ExitStack, asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, partial
+from bs4 import BeautifulSoup, SoupStrainer
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only required for the asyncio API
+    aiohttp = None
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:  # lxml is only required for the 'lxml' parser backend
+    lxml = None
 
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:  # selectolax is only required for the 'selectolax' parser backend
+    SelectolaxParser = None
 
-def import_file(csv_filename: str, random_sample: bool = False, sample_size: int = 100) -> pd.DataFrame:
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.93 Safari/537.36',
+    'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7'
+}
+REQUEST_TIMEOUT = 15
+SAMPLE_READ_CHUNK_SIZE = 100000
+THROTTLE_STATUS_CODES = (403, 429)
+RETRY_AFTER_STATUS_CODES = (429, 503)
+STREAM_CHUNK_SIZE = 16384
+# The beginnings of the values returned for URLs that could not be fetched
+ERROR_PREFIXES = ('HTTP Error:', 'Request Timeout', 'Request Exception:', 'Unexpected Error:', 'Failed after')
+TRACKING_PARAMS = ('gclid', 'fbclid', 'msclkid', 'dclid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as one JSON object per line: time, level, logger and message, plus the structured fields
+    passed with `extra` (url, status, ...) and the traceback, if any.
+    """
+
+    STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class UrlSampler(logging.Filter):
+    """
+    Keeps the records of a fixed share of the URLs: those logged with an `extra` url are kept if the URL hashes into
+    the sample, so either all or none of the lines about one URL are logged. Errors and records without a url
+    always pass.
+
+    Args:
+        rate (float): The share of URLs whose records are kept, between 0 and 1.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.threshold = int(rate * 2 ** 32)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        url = getattr(record, 'url', None)
+        if url is None or record.levelno >= logging.ERROR:
+            return True
+        return zlib.crc32(url.encode('utf-8', 'surrogatepass')) < self.threshold
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves formatting to the listener thread. The standard one merges the message and its
+    arguments in the logging thread already.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+@contextmanager
+def configured_logging(log_format: str = 'text', level: str = 'INFO', sample_rate: float = 1.0,
+                       log_file: Optional[str] = None):
+    """
+    Routes all logging through a queue for the duration of the block, so the threads that log never wait for the
+    log to be formatted or written: a background listener does that. The previous handlers are restored afterwards.
+
+    Args:
+        log_format (str): 'text' for the usual lines, 'json' for one JSON object per line (see JsonFormatter).
+            Defaults to 'text'.
+        level (str): The lowest level logged. Defaults to 'INFO'.
+        sample_rate (float): The share of URLs whose records below ERROR are logged, see UrlSampler. Defaults to 1.
+        log_file (Optional[str]): A file to append the log to. Defaults to None, which logs to stderr.
+    """
+    if log_format not in ('text', 'json'):
+        raise ValueError(f"Unknown log format '{log_format}'. Choose 'text' or 'json'.")
+    target = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(LOG_FORMAT))
+
+    log_queue = Queue()
+    handler = _LazyQueueHandler(log_queue)
+    if sample_rate < 1:
+        handler.addFilter(UrlSampler(sample_rate))
+    listener = logging.handlers.QueueListener(log_queue, target)
+
+    root = logging.getLogger()
+    previous_handlers, previous_level = root.handlers[:], root.level
+    root.handlers = [handler]
+    root.setLevel(level)
+    listener.start()
+    try:
+        yield
+    finally:
+        listener.stop()
+        target.close()
+        root.handlers = previous_handlers
+        root.setLevel(previous_level)
+
+
+def import_file(csv_filename: str, random_sample: bool = False, sample_size: int = 100,
+                columns: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Imports a CSV file into a pandas DataFrame.
 
     Args:
         csv_filename (str): The name of the CSV file to import.
-        random_sample (bool): Whether to return a random sample of the data. Defaults to False.
+        random_sample (bool): Whether to return a random sample of the data. The file is read in one pass and only the
+            sampled rows are kept in memory. Defaults to False.
         sample_size (int): The size of the random sample to return. Defaults to 100.
+        columns (Optional[List[str]]): The columns to load. Defaults to all columns.
 
     Returns:
         pd.DataFrame: The DataFrame containing the data from the CSV file. Returns an empty DataFrame if the file is not found.
     """
     try:
-        df = pd.read_csv(csv_filename)
         if not random_sample:
+            df = pd.read_csv(csv_filename, usecols=columns)
             logging.info(f"Successfully loaded data from {csv_filename}")
             return df
         else:
-            df_sample = df.sample(n=sample_size, random_state=42).reset_index(drop=True)
+            with pd.read_csv(csv_filename, usecols=columns, chunksize=SAMPLE_READ_CHUNK_SIZE) as reader:
+                df_sample = reservoir_sample(reader, sample_size, seed=42)
             logging.info(f"Successfully loaded data from {csv_filename}. Random sample of {sample_size} selected.")
             return df_sample
     except FileNotFoundError:
@@ -35,6 +196,122 @@ def import_file(csv_filename: str, random_sample: bool = False, sample_size: int
         return pd.DataFrame()
 
 
+def reservoir_sample(chunks: Iterable[pd.DataFrame], sample_size: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Draws a uniform random sample of rows from a stream of DataFrames in a single pass (reservoir sampling,
+    Algorithm R), holding no more than sample_size rows plus the current chunk in memory.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): The rows, chunk by chunk.
+        sample_size (int): The number of rows to sample. All rows are returned if there are fewer.
+        seed (int): The random seed, so that the same input gives the same sample. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: The sampled rows with a fresh index.
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = None  # indexed by reservoir slot
+    seen = 0
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        filled = 0 if reservoir is None else len(reservoir)
+        if filled < sample_size:
+            head = chunk.iloc[:sample_size - filled]
+            head.index = pd.RangeIndex(filled, filled + len(head))
+            reservoir = head if reservoir is None else pd.concat([reservoir, head])
+            chunk = chunk.iloc[len(head):]
+            seen += len(head)
+        if chunk.empty:
+            continue
+
+        # Row number t (0-based) replaces a random slot with probability sample_size / (t + 1)
+        slots = rng.integers(0, seen + np.arange(len(chunk)) + 1)
+        accepted = np.flatnonzero(slots < sample_size)
+        seen += len(chunk)
+        if not len(accepted):
+            continue
+        # When several rows of the chunk hit the same slot, the last one wins, as in the sequential algorithm
+        unique_slots, last = np.unique(slots[accepted][::-1], return_index=True)
+        chosen = accepted[::-1][last]
+        replacements = chunk.iloc[chosen]
+        replacements.index = pd.Index(unique_slots)
+        reservoir = pd.concat([reservoir.drop(index=unique_slots), replacements]).sort_index()
+
+    if reservoir is None:
+        return pd.DataFrame()
+    return reservoir.reset_index(drop=True)
+
+
+def iter_csv_chunks(csv_filename: str, chunk_size: int = 10000,
+                    columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV file in chunks, so that only chunk_size rows are held in memory at a time. The row index continues
+    across chunks.
+
+    Args:
+        csv_filename (str): The name of the CSV file to read.
+        chunk_size (int): The number of rows per chunk. Defaults to 10000.
+        columns (Optional[List[str]]): The columns to load. Defaults to all columns.
+
+    Yields:
+        pd.DataFrame: The next chunk of rows. Nothing is yielded if the file is not found.
+    """
+    try:
+        reader = pd.read_csv(csv_filename, usecols=columns, chunksize=chunk_size)
+    except FileNotFoundError:
+        logging.warning(f"'{csv_filename}' not found.")
+        return
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _prefetch(iterable: Iterable, depth: int = 2) -> Iterator:
+    """
+    Iterates over an iterable in a background thread, staying at most depth items ahead of the consumer, so that
+    e.g. the next CSV chunk is read while the current one is being fetched. If the consumer stops early, the thread
+    stops too and closes the iterable.
+    """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+            # Closed by this thread, as closing a generator another thread is running raises
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
 def print_to_file(df, output_csv_filename) -> None:
     """
     Prints a pandas DataFrame to a CSV file.
@@ -50,142 +327,3202 @@ def print_to_file(df, output_csv_filename) -> None:
         logging.error(f"Error saving to {output_csv_filename}: {e}")
 
 
-def extract_value_from_url(url_to_scrape: str, max_retries: int = 1, retry_delay: int = 5) -> Optional[str]:
+class RequestTiming:
     """
-    Extracts the requested value from a given URL. Includes a retry mechanism for HTTP 403 errors.
+    Where the time of one URL went, summed over all of its attempts, plus the number of attempts and the bytes
+    received. An extractor given a RequestTiming fills it in:
 
-    Parameters:
-        url_to_scrape (str): The URL to scrape.
-        max_retries (int): The maximum number of retries.
-        retry_delay (int): The delay in seconds between retries.
+        queue_wait: from the creation of the RequestTiming until the extraction starts, plus the time spent waiting
+            for the rate limiter and for a free connection.
+        dns, connect, tls: opening new connections. Reused connections add nothing. The async engine cannot tell
+            the TLS handshake apart and counts it as connect.
+        ttfb: from sending the request until the response headers arrive, without opening the connection.
+        download: reading the response body.
+        parse: extracting the value from the page.
+        total: from the start of the extraction until the value is returned, including retry delays.
+    """
 
-    Returns:
-        Optional[str]: The string which gets reversed. Returns None if no data is extracted.
+    PHASES = ('queue_wait', 'dns', 'connect', 'tls', 'ttfb', 'download', 'parse', 'total')
+    COLUMNS = [f'{phase}_ms' for phase in PHASES] + ['attempts', 'bytes_received']
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.attempts = 0
+        self.bytes_received = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.seconds[phase] += seconds
+
+    def setup(self) -> float:
+        """
+        Returns the time spent opening connections so far.
+        """
+        return self.seconds['dns'] + self.seconds['connect'] + self.seconds['tls']
+
+    def columns(self) -> Dict[str, float]:
+        columns = {f'{phase}_ms': round(seconds * 1000, 3) for phase, seconds in self.seconds.items()}
+        columns.update(attempts=self.attempts, bytes_received=self.bytes_received)
+        return columns
+
+
+class Metrics:
+    """
+    Counters and histograms of a run, rendered in the Prometheus text exposition format. They can be scraped from
+    a local HTTP endpoint (serve), and/or written to a file every few seconds for the node_exporter textfile
+    collector (write_textfile_every). All methods are thread-safe.
     """
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.93 Safari/537.36',
-        'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7'
+    DEFINITIONS = {
+        'scraper_urls_started_total': ('counter', 'URLs whose extraction has started.'),
+        'scraper_urls_completed_total': ('counter', 'URLs whose extraction has finished, successful or not.'),
+        'scraper_requests_started_total': ('counter', 'HTTP requests sent, including retries.'),
+        'scraper_responses_total': ('counter', 'HTTP responses received, by status code.'),
+        'scraper_request_errors_total': ('counter', 'HTTP requests that got no response, by error.'),
+        'scraper_retries_total': ('counter', 'Requests retried after a failed attempt.'),
+        'scraper_extractions_total': ('counter',
+                                      'Extractions by field and the element the value was found in, or none.'),
+        'scraper_failures_total': ('counter', 'URLs that returned an error instead of a value.'),
+        'scraper_response_bytes_total': ('counter', 'Response body bytes received.'),
+        'scraper_request_duration_seconds': ('histogram', 'Duration of single HTTP requests.'),
+        'scraper_url_duration_seconds': ('histogram', 'Duration of whole URL extractions, including retries.'),
     }
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[str, List[float]] = {}  # bucket counts, then sum and count
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.textfile: Optional[str] = None
+        self.stopped = threading.Event()
+        self.writer: Optional[threading.Thread] = None
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            histogram = self.histograms.setdefault(name, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: list(values) for name, values in self.histograms.items()}
+        lines = []
+        for name, (kind, description) in self.DEFINITIONS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if kind == 'histogram':
+                values = histograms.get(name, [0] * (len(self.BUCKETS) + 2))
+                for bound, count in zip(self.BUCKETS, values):
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+                lines += [f'{name}_bucket{{le="+Inf"}} {values[-1]}', f"{name}_sum {values[-2]}",
+                          f"{name}_count {values[-1]}"]
+                continue
+            samples = sorted((labels, value) for (sample, labels), value in counters.items() if sample == name)
+            for labels, value in samples or [((), 0)]:
+                label_text = ','.join(f'{key}="{_escape_label(str(label))}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filename: str) -> None:
+        """
+        Replaces the file with the current metrics atomically, so a collector never reads a partial file.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False, encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(f.name, filename)
+
+    def write_textfile_every(self, filename: str, interval: float = 15) -> None:
+        """
+        Rewrites the file every interval seconds in a background thread, and once more on close().
+        """
+        self.textfile = filename
+
+        def write_periodically():
+            while not self.stopped.wait(interval):
+                self.write_textfile(filename)
+
+        self.writer = threading.Thread(target=write_periodically, name='metrics-textfile', daemon=True)
+        self.writer.start()
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> None:
+        """
+        Serves the metrics at http://host:port/metrics from a background thread until close().
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+        logging.info(f"Serving metrics at http://{host}:{self.server.server_port}/metrics")
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.textfile is not None:
+            self.write_textfile(self.textfile)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The Metrics of the extraction running in the current thread or task, if it records any
+_current_metrics: ContextVar[Optional[Metrics]] = ContextVar('current_metrics', default=None)
+
+
+def _metric_inc(name: str, amount: float = 1, **labels: str) -> None:
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.inc(name, amount, **labels)
+
+
+# The RequestTiming of the extraction running in the current thread or task, if it records one
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar('current_timing', default=None)
 
-    extracted_text = None
-    attempt = 0
 
-    while attempt <= max_retries:  # Attempt until the max_retries is met
-        logging.info(f"Processing URL: {url_to_scrape} (Attempt: {attempt + 1} of {max_retries + 1}")
+def _start_recording(timing: Optional[RequestTiming], metrics: Optional[Metrics]) -> Callable[[], None]:
+    """
+    Counts the start of an extraction in timing and metrics. Returns the function that counts its end.
+    """
+    start = time.perf_counter()
+    if timing is not None:
+        timing.add('queue_wait', start - timing.created)
+    if metrics is not None:
+        metrics.inc('scraper_urls_started_total')
+
+    def finish() -> None:
+        elapsed = time.perf_counter() - start
+        if timing is not None:
+            timing.add('total', elapsed)
+        if metrics is not None:
+            metrics.inc('scraper_urls_completed_total')
+            metrics.observe('scraper_url_duration_seconds', elapsed)
+
+    return finish
+
+
+@contextmanager
+def _recording_to(timing: Optional[RequestTiming], metrics: Optional[Metrics]):
+    """
+    Makes timing and metrics those of the current extraction for the duration of the block.
+    """
+    timing_token = _current_timing.set(timing)
+    metrics_token = _current_metrics.set(metrics)
+    try:
+        yield
+    finally:
+        _current_timing.reset(timing_token)
+        _current_metrics.reset(metrics_token)
+
+
+@contextmanager
+def _recording(timing: Optional[RequestTiming], metrics: Optional[Metrics]):
+    """
+    Records the extraction run in the block in timing and metrics, see _start_recording and _recording_to.
+    """
+    finish = _start_recording(timing, metrics)
+    try:
+        with _recording_to(timing, metrics):
+            yield
+    finally:
+        finish()
+
+
+def _then(future: Future, function: Callable[[Future], object]) -> Future:
+    """
+    Returns a Future of function(future), called once future is done, in the thread that completes it and in the
+    context of the caller. The returned Future raises whatever function raises.
+    """
+    context = copy_context()
+    chained = Future()
+
+    def done(source: Future) -> None:
         try:
-            response = requests.get(url_to_scrape, headers=headers, timeout=15)
-            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            chained.set_result(context.run(function, source))
+        except BaseException as e:
+            chained.set_exception(e)
 
-            # Attempt to find the primary element
-            result_counter = soup.find('span', id='sidebar-title') # find the first page element that matches the criteria
-            if result_counter:
-                extracted_text = result_counter.get_text(strip=True)
-            else:
-                result_counter_fallback = soup.find('span', attrs={'qaselector': 'sidebar-result-counter'})
-                if result_counter_fallback:
-                    extracted_text = result_counter_fallback.get_text(strip=True)
+    future.add_done_callback(done)
+    return chained
 
-            if extracted_text:
-                logging.info(f"Successfully extracted: {extracted_text}")
-                return extracted_text
-            else:
-                logging.warning(f"Could not extract data for {url_to_scrape} (element not found).")
-                return None
 
-        except requests.exceptions.HTTPError as http_err:
-            status_code = http_err.response.status_code if hasattr(http_err, 'response') and http_err.response is not None else 'N/A'
-            logging.error(f"HTTP Error for {url_to_scrape}: {http_err} - Status: {status_code}")
-
-            if status_code == 403 and attempt < max_retries:
-                logging.info(f"Received 403 Forbidden. Waiting {retry_delay} seconds before retrying (Attempt {attempt + 1} failed)...")
-                time.sleep(retry_delay)
-                attempt += 1
-                continue # Retry
-            else:
-                # If not a 403, or if it's a 403 but no more retries left
-                return f"HTTP Error: {status_code} (Attempt {attempt + 1})"
-
-        except requests.exceptions.Timeout:
-            logging.error(f"Request Timeout for {url_to_scrape}.")
-            if attempt < max_retries:
-                logging.info(f"Waiting {retry_delay} seconds before retrying due to timeout...")
-                time.sleep(retry_delay)
-                attempt += 1
-                continue # Retry
-            else:
-                return "Request Timeout"
+@contextmanager
+def _measure(phase: str):
+    """
+    Adds the duration of the block to the given phase of the current RequestTiming, if there is one.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(phase, time.perf_counter() - start)
 
-        except requests.exceptions.RequestException as req_err:
-            logging.error(f"Request Exception for {url_to_scrape}: {req_err}")
-            return f"Request Exception: {str(req_err)}"
 
-        except Exception as e:
-            logging.exception(f"An unexpected error occurred for {url_to_scrape}: {e}")
-            return f"Unexpected Error: {str(e)}"
+@contextmanager
+def _measure_download():
+    """
+    Adds the duration of the block to the download phase of the current RequestTiming, without the parse time
+    measured inside it.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    parsed = timing.seconds['parse']
+    try:
+        yield
+    finally:
+        timing.add('download', time.perf_counter() - start - (timing.seconds['parse'] - parsed))
 
-    # If loop finishes without returning (e.g. all retries failed for 403)
-    return f"Failed after {max_retries + 1} attempts (last error was likely 403 or Timeout)"
 
+def _add_bytes(count: int) -> None:
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.bytes_received += count
+    _metric_inc('scraper_response_bytes_total', count)
 
 
-def process_urls(csv_filename: str, output_csv_filename: str, random_sample: bool = False, sample_size: int = 100) -> None:
+class _TimedConnectionMixin:
     """
-    Processes the supplied URLs from a CSV file, extracts the searched values, and saves the results to a new CSV file.
+    Splits opening a urllib3 connection into DNS resolution, TCP connect and TLS handshake for the current
+    RequestTiming. Without one the connection is opened as usual.
+    """
+
+    def _new_conn(self):
+        timing = _current_timing.get()
+        if timing is None:
+            return super()._new_conn()
+        start = time.perf_counter()
+        try:
+            addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(self._dns_host, self.port, 0,
+                                                                                    socket.SOCK_STREAM)))
+        except socket.gaierror:
+            addresses = []  # urllib3 reports the resolution error below
+        resolved = time.perf_counter()
+        timing.add('dns', resolved - start)
+
+        # Connect to the resolved addresses in turn, like urllib3 does. self.host keeps the name for TLS and the
+        # Host header.
+        dns_host = self._dns_host
+        try:
+            for address in addresses[:-1]:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError:
+                    continue
+            if addresses:
+                self._dns_host = addresses[-1]
+            return super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+            timing.add('connect', time.perf_counter() - resolved)
+            self._opened_in = time.perf_counter() - start
+
+    def connect(self):
+        timing = _current_timing.get()
+        start = time.perf_counter()
+        self._opened_in = 0.0
+        super().connect()
+        if timing is not None and isinstance(self, HTTPSConnection):
+            timing.add('tls', max(time.perf_counter() - start - self._opened_in, 0.0))
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose connections report their setup time to the current RequestTiming.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+
+def _timing_trace_config() -> 'aiohttp.TraceConfig':
+    """
+    Returns an aiohttp TraceConfig that reports connection queueing, DNS resolution and connection setup to the
+    current RequestTiming.
+    """
+    async def start(session, context, params, phase: str) -> None:
+        timing = _current_timing.get()
+        if timing is not None:
+            setattr(context, phase, (time.perf_counter(), timing.seconds['dns']))
+
+    async def end(session, context, params, phase: str) -> None:
+        timing = _current_timing.get()
+        if timing is not None and hasattr(context, phase):
+            started, dns_before = getattr(context, phase)
+            elapsed = time.perf_counter() - started
+            if phase == 'connect':  # creating a connection includes resolving its host
+                elapsed -= timing.seconds['dns'] - dns_before
+            timing.add(phase, elapsed)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(partial(start, phase='queue_wait'))
+    trace_config.on_connection_queued_end.append(partial(end, phase='queue_wait'))
+    trace_config.on_dns_resolvehost_start.append(partial(start, phase='dns'))
+    trace_config.on_dns_resolvehost_end.append(partial(end, phase='dns'))
+    trace_config.on_connection_create_start.append(partial(start, phase='connect'))
+    trace_config.on_connection_create_end.append(partial(end, phase='connect'))
+    return trace_config
+
+
+def create_session(pool_maxsize: int = 10, pool_connections: int = 10,
+                   record_timings: bool = False) -> requests.Session:
+    """
+    Creates a keep-alive HTTP session with the default headers set once, so that consecutive requests to the same
+    host reuse open connections instead of paying for a new TCP and TLS handshake every time.
 
     Args:
-        csv_filename (str): The name of the input CSV file.
-        output_csv_filename (str): The name of the output CSV file.
-        random_sample (bool): Whether to use a random sample of the data. Defaults to False.
-        sample_size (int): The size of the random sample to use. Defaults to 100.
+        pool_maxsize (int): The maximum number of connections kept open per host. Should be at least the number of
+            concurrent workers. Defaults to 10.
+        pool_connections (int): The number of hosts whose connection pools are cached. Defaults to 10.
+        record_timings (bool): Whether new connections report their DNS, connect and TLS times to the current
+            RequestTiming. Defaults to False.
+
+    Returns:
+        requests.Session: The configured session. Close it (or use it as a context manager) when the run is over.
     """
-    results = []
-    df = import_file(csv_filename, random_sample, sample_size)
-    if df.empty:
-        logging.error("DataFrame is empty, exiting process_urls.")
-        return
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter_class = _TimedHTTPAdapter if record_timings else HTTPAdapter
+    adapter = adapter_class(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-    df['results'] = None
 
-    total_requests_to_make = df['url'].count()
-    requests_made_count = 0
+class TokenBucket:
+    """
+    A thread-safe token bucket. Tokens refill at `rate` per second up to `burst`, and every request consumes one.
+    """
 
-    for index, row in df.iterrows(): #  the method generates an iterator object of the df, to iterate each row. Each iteration produces an index object and a row object (a Series object).
-        url = str(row['url']) if pd.notna(row['url']) else ""
-        logging.info(f"Processing row {index + 1} of {len(df)}:")
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-        # Process the url
-        if url.strip():
-            result_value = extract_value_from_url(url, max_retries=2, retry_delay=5)
-            df.at[index, 'results'] = result_value
-            requests_made_count += 1
-            if requests_made_count < total_requests_to_make:
-                time.sleep(2)
-        else:
-            logging.info(f"Skipped empty or invalid url for row {index + 1}.")
+    def reserve(self) -> float:
+        """
+        Takes a token and returns the number of seconds the caller has to wait before using it. The balance may go
+        negative, so concurrent callers queue up behind each other instead of all waking at the same moment.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
 
+    def set_rate(self, rate: float) -> None:
+        """
+        Changes the refill rate. Tokens earned so far are credited at the old rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
 
-    logging.info("\n--- Updated DataFrame ---")
-    logging.info(df)
 
-    print_to_file(df, output_csv_filename)
+def _set_result(future: asyncio.Future, result) -> None:
+    if not future.done():  # the waiting task may have been cancelled
+        future.set_result(result)
 
 
-def main(payload: dict) -> None:
+class HostRateLimiter:
     """
-    Main function to execute the data processing workflow.
+    Keeps one token bucket per host, so requests to different domains do not wait for each other while every
+    host is still limited to `rate` requests per second with bursts of up to `burst` requests.
+    """
+
+    def __init__(self, rate: float = 0.5, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def reserve(self, url: str) -> float:
+        return self.bucket(urlsplit(url).netloc.lower()).reserve()
+
+    def wait(self, url: str) -> None:
+        """
+        Blocks until a request to the host of the URL is allowed.
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_wait(self, url: str) -> None:
+        """
+        Asyncio counterpart of wait, which suspends only the calling task.
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def release(self, url: str, throttled: Optional[bool]) -> None:
+        """
+        Reports the outcome of a request sent after wait: True if the host throttled it, False if it succeeded and
+        None if the outcome says nothing about the host's tolerance. The fixed-rate limiter ignores it.
+        """
+
+
+class AdaptiveRateLimiter(HostRateLimiter):
+    """
+    A HostRateLimiter that tunes the rate and the number of concurrent requests of every host with AIMD (additive
+    increase, multiplicative decrease). Each success raises the rate by `rate_step` and the concurrency by
+    1/concurrency, and each 403/429 or timeout multiplies both by `backoff_factor`. Every host converges to the
+    highest rate it tolerates. A request that gives up while waiting (e.g. a cancelled task) hands its
+    concurrency slot back. Blocked threads wait on a Condition and blocked tasks on a future of their event loop,
+    which release() completes.
+    """
+
+    def __init__(self, rate: float = 0.5, burst: int = 1, max_rate: float = 10.0, min_rate: float = 0.05,
+                 max_concurrency: int = 10, rate_step: float = 0.05, backoff_factor: float = 0.5):
+        super().__init__(rate, burst)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.backoff_factor = backoff_factor
+        self.concurrency: Dict[str, float] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.slots = threading.Condition()
+        self.async_waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+    def _try_acquire_slot(self, host: str) -> bool:
+        limit = int(self.concurrency.setdefault(host, 1.0))
+        if self.in_flight.get(host, 0) >= limit:
+            return False
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        return True
+
+    def _notify(self, host: str) -> None:
+        # Called with self.slots held
+        self.slots.notify_all()
+        for loop, woken in self.async_waiters.pop(host, ()):
+            loop.call_soon_threadsafe(_set_result, woken, None)
+
+    def _release_slot(self, host: str) -> None:
+        with self.slots:
+            self.in_flight[host] -= 1
+            self._notify(host)
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc.lower()
+        with self.slots:
+            self.slots.wait_for(lambda: self._try_acquire_slot(host))
+        try:
+            super().wait(url)
+        except BaseException:
+            self._release_slot(host)
+            raise
+
+    async def async_wait(self, url: str) -> None:
+        host = urlsplit(url).netloc.lower()
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.slots:
+                if self._try_acquire_slot(host):
+                    break
+                woken = loop.create_future()
+                self.async_waiters.setdefault(host, []).append((loop, woken))
+            await woken
+        try:
+            await super().async_wait(url)
+        except BaseException:
+            self._release_slot(host)
+            raise
+
+    def release(self, url: str, throttled: Optional[bool]) -> None:
+        host = urlsplit(url).netloc.lower()
+        bucket = self.bucket(host)
+        with self.slots:
+            self.in_flight[host] -= 1
+            concurrency = self.concurrency[host]
+            if throttled:
+                self.concurrency[host] = max(1.0, concurrency * self.backoff_factor)
+                bucket.set_rate(max(self.min_rate, bucket.rate * self.backoff_factor))
+                logging.info(f"Throttled by {host}. Reduced to {bucket.rate:.2f} req/s and "
+                             f"{int(self.concurrency[host])} concurrent requests.")
+            elif throttled is not None:
+                self.concurrency[host] = min(float(self.max_concurrency), concurrency + 1 / concurrency)
+                bucket.set_rate(min(self.max_rate, bucket.rate + self.rate_step))
+            self._notify(host)
+
+
+def create_rate_limiter(requests_per_second: Optional[float] = 0.5, burst: int = 1, adaptive: bool = False,
+                        max_requests_per_second: float = 10.0, max_concurrency: int = 1) -> Optional[HostRateLimiter]:
+    """
+    Creates the per-host rate limiter for a run.
 
     Args:
-        payload (dict): A dictionary containing the configuration parameters.
+        requests_per_second (Optional[float]): The (initial) request rate per host. None disables rate limiting
+            unless adaptive is set, in which case the rate starts at 1 request per second.
+        burst (int): The number of requests a host may receive back to back. Defaults to 1.
+        adaptive (bool): Whether to tune rate and concurrency per host from the responses (AIMD). Defaults to False.
+        max_requests_per_second (float): The upper bound of the adaptive rate. Defaults to 10.
+        max_concurrency (int): The upper bound of the adaptive number of concurrent requests per host.
+
+    Returns:
+        Optional[HostRateLimiter]: The limiter, or None if requests are not limited.
+    """
+    if adaptive:
+        return AdaptiveRateLimiter(requests_per_second or 1.0, burst, max_rate=max_requests_per_second,
+                                   max_concurrency=max_concurrency)
+    if requests_per_second:
+        return HostRateLimiter(requests_per_second, burst)
+    return None
+
+
+class RetryPolicy:
+    """
+    Decides which failed attempts are retried and how long to wait before the next attempt.
+
+    Delays grow exponentially from `base_delay` and are capped at `max_delay`. With full jitter, the actual delay is
+    drawn uniformly between 0 and that value, so workers that failed together do not retry in lockstep. A
+    Retry-After header on 429/503 responses takes precedence, also capped at `max_delay`.
+    """
+
+    def __init__(self, max_retries: int = 1, base_delay: float = 5, max_delay: float = 60, jitter: bool = True,
+                 retry_status_codes: Tuple[int, ...] = (403, 429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_status_codes = retry_status_codes
+
+    def should_retry(self, attempt: int, status_code: Optional[int] = None) -> bool:
+        """
+        Returns whether a failed attempt (0-based) is retried. Without a status code the failure was a timeout or
+        a connection error, which is always retried while attempts are left.
+        """
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in self.retry_status_codes
+
+    def delay(self, attempt: int, status_code: Optional[int] = None, retry_after: Optional[str] = None) -> float:
+        """
+        Returns the number of seconds to wait before retrying after the given failed attempt (0-based).
+        """
+        if retry_after and status_code in RETRY_AFTER_STATUS_CODES:
+            requested = _parse_retry_after(retry_after)
+            if requested is not None:
+                return min(self.max_delay, requested)
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, ceiling) if self.jitter else ceiling
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """
+    Parses a Retry-After header, given either in seconds or as an HTTP date, into a number of seconds.
     """
     try:
-        process_urls(
-            payload['csv_filename'],
-            payload['output_csv_filename'],
-            payload['random_sample'],
-            payload['sample_size']
-        )
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CachedResponse(NamedTuple):
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class ResponseCache:
+    """
+    A persistent cache of response bodies on disk, one gzipped JSON file per URL. Entries younger than `ttl`
+    seconds are used without any request. Older entries are revalidated with If-None-Match / If-Modified-Since,
+    and a 304 Not Modified answer reuses the stored body without downloading it again.
+
+    Args:
+        directory (str): The cache directory. Created if needed.
+        ttl (float): The number of seconds an entry is used without revalidation. Defaults to one day.
+    """
+
+    def __init__(self, directory: str, ttl: float = 86400):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        try:
+            with gzip.open(self._path(url), 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError) as e:
+            logging.warning(f"Ignoring unreadable cache entry for {url}: {e}")
+            return None
+        return CachedResponse(entry['text'], entry['etag'], entry['last_modified'], entry['stored_at'])
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CachedResponse]) -> Optional[Dict[str, str]]:
+        """
+        Returns the headers that make a request conditional on the cached entry having changed.
+        """
+        if entry is None:
+            return None
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers or None
+
+    def store(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'url': url, 'text': text, 'etag': etag, 'last_modified': last_modified, 'stored_at': time.time()}
+        # Written to a temporary file and renamed, so readers never see a half-written entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with gzip.open(os.fdopen(fd, 'wb'), 'wt', encoding='utf-8', compresslevel=1) as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def refresh(self, url: str, entry: CachedResponse) -> None:
+        """
+        Marks a revalidated entry as fresh again.
+        """
+        self.store(url, entry.text, entry.etag, entry.last_modified)
+
+
+class ArchivedResponse(NamedTuple):
+    url: str
+    date: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    encoding: Optional[str]
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class ResponseArchive:
+    """
+    An append-only archive of raw responses in the WARC/1.0 format: every response is stored as a 'response'
+    record holding its status line, headers and body, and the time it was received. Every record is a gzip member
+    of its own, as in .warc.gz files, so the file is never rewritten and a crash loses at most the record being
+    written. An archive that is reused is first cut back to its last complete record, so that the records of the
+    new run are not appended after a truncated one, where read() would never reach them. The charset the body was
+    decoded with is kept in a WARC-X-Text-Encoding field, so that re-extraction (see reextract_archive) sees exactly
+    the same text as the original run.
+
+    Args:
+        filename (str): The archive file. Records are appended if it exists.
+    """
+
+    # Describe the body as stored: decompressed and in one piece
+    DROPPED_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        if os.path.exists(filename):
+            complete = self._complete_length(filename)
+            if complete < os.path.getsize(filename):
+                logging.warning(f"Archive {filename} ends with an incomplete record. Dropping its last "
+                                f"{os.path.getsize(filename) - complete} bytes before appending.")
+                with open(filename, 'r+b') as f:
+                    f.truncate(complete)
+        self.file = open(filename, 'ab')
+        self.lock = threading.Lock()
+        self.records = 0
+
+    @staticmethod
+    def _complete_length(filename: str, block_size: int = 1 << 20) -> int:
+        """
+        Returns the number of bytes taken by the complete gzip members at the start of the file.
+        """
+        complete = 0
+        offset = 0
+        decompressor = zlib.decompressobj(wbits=31)
+        with open(filename, 'rb') as f:
+            for data in iter(lambda: f.read(block_size), b''):
+                while data:
+                    try:
+                        decompressor.decompress(data)
+                    except zlib.error:
+                        return complete
+                    if not decompressor.eof:
+                        offset += len(data)
+                        break
+                    offset += len(data) - len(decompressor.unused_data)
+                    complete = offset
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+        return complete
+
+    def write(self, url: str, status: int, reason: Optional[str], headers: Iterable[Tuple[str, str]], body: bytes,
+              encoding: Optional[str] = None) -> None:
+        http_headers = ''.join(f"{name}: {value}\r\n" for name, value in headers
+                               if name.lower() not in self.DROPPED_HEADERS)
+        block = (f"HTTP/1.1 {status} {reason or ''}\r\n{http_headers}Content-Length: {len(body)}\r\n\r\n"
+                 .encode('utf-8', 'replace') + body)
+        digest = base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+        warc_headers = [
+            ('WARC-Type', 'response'),
+            ('WARC-Record-ID', f"<urn:uuid:{uuid.uuid4()}>"),
+            ('WARC-Date', datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')),
+            ('WARC-Target-URI', url),
+            ('WARC-Payload-Digest', f"sha1:{digest}"),
+            ('Content-Type', 'application/http; msgtype=response'),
+            ('Content-Length', str(len(block))),
+        ]
+        if encoding:
+            warc_headers.append(('WARC-X-Text-Encoding', encoding))
+        record = ('WARC/1.0\r\n' + ''.join(f"{name}: {value}\r\n" for name, value in warc_headers) + '\r\n')
+        member = gzip.compress(record.encode('utf-8') + block + b'\r\n\r\n')
+        with self.lock:
+            self.file.write(member)
+            self.file.flush()
+            self.records += 1
+
+    def close(self) -> None:
+        self.file.close()
+        logging.info(f"Archived {self.records} responses to {self.filename}")
+
+    @staticmethod
+    def read(filename: str) -> Iterator[ArchivedResponse]:
+        """
+        Yields the response records of an archive in the order they were written. A record cut short by a crash
+        ends the archive.
+        """
+        with gzip.open(filename, 'rb') as f:
+            while True:
+                try:
+                    line = f.readline()
+                    while line in (b'\r\n', b'\n'):
+                        line = f.readline()
+                    if not line:
+                        return
+                    warc_headers = _read_header_block(f)
+                    block = f.read(int(warc_headers['content-length']))
+                except (EOFError, OSError, KeyError, ValueError) as e:
+                    logging.warning(f"Archive {filename} ends with an incomplete record: {e}")
+                    return
+                if warc_headers.get('warc-type') != 'response':
+                    continue
+                head, _, body = block.partition(b'\r\n\r\n')
+                status_line, *header_lines = head.decode('utf-8', 'replace').split('\r\n')
+                headers = dict(line.split(': ', 1) for line in header_lines if ': ' in line)
+                yield ArchivedResponse(warc_headers['warc-target-uri'], warc_headers.get('warc-date', ''),
+                                       int(status_line.split(' ')[1]), headers, body,
+                                       warc_headers.get('warc-x-text-encoding'))
+
+
+def _read_header_block(f) -> Dict[str, str]:
+    """
+    Reads 'Name: value' lines up to an empty line, with the names lowercased.
+    """
+    headers = {}
+    for line in iter(f.readline, b''):
+        line = line.decode('utf-8', 'replace').rstrip('\r\n')
+        if not line:
+            return headers
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    raise EOFError("unexpected end of the header block")
+
+
+def _send_request(url_to_scrape: str, session: Optional[requests.Session] = None,
+                  rate_limiter: Optional[HostRateLimiter] = None, stream: bool = False,
+                  headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    """
+    Sends one GET request, waiting for the rate limiter first and reporting the outcome to it afterwards. With
+    stream=True only the headers have been read when it returns, and the caller has to close the response.
+    `headers` are sent on top of the default headers.
+    """
+    timing = _current_timing.get()
+    metrics = _current_metrics.get()
+    throttled = None
+    admitted = False
+    try:
+        if rate_limiter is not None:
+            with _measure('queue_wait'):
+                rate_limiter.wait(url_to_scrape)
+            admitted = True
+        if timing is not None:
+            timing.attempts += 1
+            setup = timing.setup()
+        if metrics is not None:
+            metrics.inc('scraper_requests_started_total')
+        sent = time.perf_counter()
+        if session is not None:
+            response = session.get(url_to_scrape, headers=headers, timeout=REQUEST_TIMEOUT, stream=stream)
+        else:
+            response = requests.get(url_to_scrape, headers={**DEFAULT_HEADERS, **(headers or {})},
+                                    timeout=REQUEST_TIMEOUT, stream=stream)
+        if timing is not None:
+            # requests measures up to the headers, and reads the body afterwards unless streaming
+            headers_received = response.elapsed.total_seconds()
+            timing.add('ttfb', max(headers_received - (timing.setup() - setup), 0.0))
+            if not stream:
+                timing.add('download', time.perf_counter() - sent - headers_received)
+        if not stream and (timing is not None or metrics is not None):
+            _add_bytes(len(response.content))
+        if metrics is not None:
+            metrics.inc('scraper_responses_total', status=str(response.status_code))
+            metrics.observe('scraper_request_duration_seconds', time.perf_counter() - sent)
+        throttled = True if response.status_code in THROTTLE_STATUS_CODES else (False if response.ok else None)
+        return response
+    except requests.exceptions.Timeout:
+        throttled = True
+        _metric_inc('scraper_request_errors_total', error='timeout')
+        raise
+    except requests.exceptions.RequestException:
+        _metric_inc('scraper_request_errors_total', error='connection')
+        raise
+    finally:
+        # A wait that raised has handed its slot back already
+        if admitted:
+            rate_limiter.release(url_to_scrape, throttled)
+
+
+@asynccontextmanager
+async def _async_request(url_to_scrape: str, session: 'aiohttp.ClientSession',
+                         rate_limiter: Optional[HostRateLimiter] = None, headers: Optional[Dict[str, str]] = None):
+    """
+    Asyncio counterpart of _send_request, used as `async with _async_request(...) as response`. Raises
+    aiohttp.ClientResponseError for bad responses. The body is read inside the block.
+    """
+    timing = _current_timing.get()
+    metrics = _current_metrics.get()
+    throttled = None
+    admitted = False
+    try:
+        if rate_limiter is not None:
+            with _measure('queue_wait'):
+                await rate_limiter.async_wait(url_to_scrape)
+            admitted = True
+        if timing is not None:
+            timing.attempts += 1
+            waited = timing.setup() + timing.seconds['queue_wait']
+        if metrics is not None:
+            metrics.inc('scraper_requests_started_total')
+        sent = time.perf_counter()
+        async with session.get(url_to_scrape, headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as response:
+            if timing is not None:
+                timing.add('ttfb', max(time.perf_counter() - sent
+                                       - (timing.setup() + timing.seconds['queue_wait'] - waited), 0.0))
+            if metrics is not None:
+                metrics.inc('scraper_responses_total', status=str(response.status))
+            throttled = True if response.status in THROTTLE_STATUS_CODES else (False if response.ok else None)
+            if metrics is not None and not response.ok:
+                metrics.observe('scraper_request_duration_seconds', time.perf_counter() - sent)
+            response.raise_for_status()
+            yield response
+            if metrics is not None:
+                metrics.observe('scraper_request_duration_seconds', time.perf_counter() - sent)
+    except asyncio.TimeoutError:
+        throttled = True
+        _metric_inc('scraper_request_errors_total', error='timeout')
+        raise
+    except aiohttp.ClientConnectionError:
+        _metric_inc('scraper_request_errors_total', error='connection')
+        raise
+    finally:
+        # A wait that raised has handed its slot back already
+        if admitted:
+            rate_limiter.release(url_to_scrape, throttled)
+
+
+# The rules used when none are given: the output field, and the elements holding its value in order of preference
+DEFAULT_EXTRACTION_RULES = {'results': ['span#sidebar-title', 'span[qaselector=sidebar-result-counter]']}
+
+# What a parser backend found for a field: the extracted text, and the index in the field's selector list of the
+# element it was taken from (None if no element was found)
+Match = Tuple[Optional[str], Optional[int]]
+
+# What the extraction of a row returns: the value of a single field, the values by field name with several fields,
+# or an error message (see ERROR_PREFIXES)
+Extracted = Optional[Union[str, Dict[str, Optional[str]]]]
+
+_SELECTOR_PATTERN = re.compile(r'\s*([a-zA-Z][\w-]*)?(?:#([\w-]+)|\[\s*([\w:-]+)\s*=\s*'
+                               r'(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'\]]+))\s*\])\s*')
+
+
+# Markup, after its '<', in which html.parser sees no tags: comments (an unterminated one is read as text up to the
+# next '>'), and the contents of <script> and <style>. A comment ends where html.parser's (private) commentclose
+# pattern matches
+_RAW_MARKUP_PATTERN = (r'!--(?:.*?--\s*>|[^>]*>?)'
+                       r'|(script|style)(?=[\s/>]).*?(?:</\s*\1\s*>|\Z)')
+
+
+def _xpath_literal(value: str) -> str:
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return 'concat(' + ', \'"\', '.join(f'"{part}"' for part in value.split('"')) + ')'
+
+
+class Selector(NamedTuple):
+    """
+    An element picked by the value of one of its attributes, written 'tag#id' or 'tag[attribute=value]' (the value
+    may be quoted, and the tag left out). Only this subset of CSS is supported, so that every parser backend,
+    including the regular expression and streaming ones, finds the same element.
+    """
+    tag: Optional[str]
+    attribute: str
+    value: str
+
+    @classmethod
+    def parse(cls, selector: str) -> 'Selector':
+        match = _SELECTOR_PATTERN.fullmatch(selector)
+        if match is None:
+            raise ValueError(f"Unsupported selector '{selector}'. Use 'tag#id' or 'tag[attribute=value]'.")
+        tag, element_id, attribute, *values = match.groups()
+        if element_id is not None:
+            attribute, value = 'id', element_id
+        else:
+            value = next(value for value in values if value is not None)
+        if attribute.lower() == 'class':
+            # BeautifulSoup matches single class names, the other backends the whole attribute
+            raise ValueError(f"Unsupported selector '{selector}'. Class attributes cannot be matched.")
+        return cls(tag.lower() if tag else None, attribute.lower(), value)
+
+    def css(self) -> str:
+        return f"{self.tag or ''}[{self.attribute}={json.dumps(self.value, ensure_ascii=False)}]"
+
+    def xpath(self) -> str:
+        return f"//{self.tag or '*'}[@{self.attribute}={_xpath_literal(self.value)}]"
+
+    def pattern(self) -> 're.Pattern':
+        # Finds the candidate start tags in the raw page, which TargetSpanParser confirms. Comments and the contents
+        # of <script> and <style> are matched as a whole, so that no candidate is taken from inside them.
+        tag = re.escape(self.tag) if self.tag else r'[a-z][\w:-]*'
+        return re.compile(r'<(?:' + _RAW_MARKUP_PATTERN + r'|(?P<target>' + tag
+                          + r'\b[^>]*?(?<![\w-])' + re.escape(self.attribute) + r'\s*=\s*["\']?'
+                          + re.escape(self.value) + r'(?=["\'\s/>])))', re.IGNORECASE | re.DOTALL)
+
+
+class ExtractionRules:
+    """
+    The fields to extract from every page, each with the selectors (see Selector) of the elements that may hold its
+    value, in order of preference. The first of them present on the page gives the value. The rules are compiled
+    once, into the form every parser backend needs, and all fields are extracted from a single parse of the page.
+
+    Args:
+        fields (Dict[str, Sequence[str]]): The selectors by field name, e.g. DEFAULT_EXTRACTION_RULES. A field with
+            a single selector may give it as a string. The names of the other output columns (RESERVED_COLUMNS)
+            are not valid field names.
+    """
+
+    # The output columns that are not fields: the input URL, the archive timestamp of reextract_archive and the
+    # timings of record_timings
+    RESERVED_COLUMNS = ('url', 'archived_at', *RequestTiming.COLUMNS)
+
+    def __init__(self, fields: Dict[str, Sequence[str]]):
+        if not fields:
+            raise ValueError("Extraction rules need at least one field.")
+        self.spec = tuple((name, (selectors,) if isinstance(selectors, str) else tuple(selectors))
+                          for name, selectors in fields.items())
+        self.fields = [name for name, _ in self.spec]
+        self.selectors: List[Selector] = []
+        self.field_indexes: List[range] = []  # the positions in selectors of every field's selectors
+        for name, selectors in self.spec:
+            if not selectors:
+                raise ValueError(f"Field '{name}' has no selectors.")
+            if name in self.RESERVED_COLUMNS:
+                raise ValueError(f"Field name '{name}' is taken by an output column. Choose another name.")
+            start = len(self.selectors)
+            self.selectors.extend(Selector.parse(selector) for selector in selectors)
+            self.field_indexes.append(range(start, len(self.selectors)))
+        self.fingerprint = hashlib.sha256(json.dumps(self.spec).encode('utf-8')).hexdigest()
+        self.preferred = [indexes[0] for indexes in self.field_indexes]
+        self.soup_filters = [(selector.tag or True, {selector.attribute: selector.value})
+                             for selector in self.selectors]
+        tags = {selector.tag for selector in self.selectors}
+        self.strainer = SoupStrainer(sorted(tags)) if None not in tags else None
+        self.patterns = [selector.pattern() for selector in self.selectors]
+        self.css = [selector.css() for selector in self.selectors]
+        self._xpaths = None
+
+    def xpaths(self) -> list:
+        if self._xpaths is None:
+            # Compiled on first use, because lxml is optional
+            self._xpaths = [lxml.etree.XPath(selector.xpath()) for selector in self.selectors]
+        return self._xpaths
+
+    def resolve(self, find: Callable[[int], Optional[str]]) -> Tuple[Match, ...]:
+        """
+        Returns the Match of every field. find is called with the positions in selectors of the field's selectors,
+        in order of preference, and returns the text of the selected element, or None if it is not on the page.
+        """
+        matches = []
+        for indexes in self.field_indexes:
+            for target, index in enumerate(indexes):
+                text = find(index)
+                if text is not None:
+                    matches.append((text or None, target))
+                    break
+            else:
+                matches.append((None, None))
+        return tuple(matches)
+
+    def reordered(self, orders: Sequence[Sequence[int]]) -> 'ExtractionRules':
+        """
+        Returns the rules with the selectors of every field in another order: orders holds, for every field, the
+        indexes in its selector list in the new order.
+        """
+        spec = tuple((name, tuple(selectors[index] for index in order))
+                     for (name, selectors), order in zip(self.spec, orders))
+        return self if spec == self.spec else _compiled_rules(spec)
+
+    def __reduce__(self):
+        # Parse pool workers receive the rules with every page, and compile them once per process
+        return _compiled_rules, (self.spec,)
+
+
+@lru_cache(maxsize=None)
+def _compiled_rules(spec: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> ExtractionRules:
+    return ExtractionRules(dict(spec))
+
+
+_DEFAULT_RULES = ExtractionRules(DEFAULT_EXTRACTION_RULES)
+
+
+def _find_in_soup(soup: BeautifulSoup, rules: ExtractionRules) -> Tuple[Match, ...]:
+    def find(index: int) -> Optional[str]:
+        name, attrs = rules.soup_filters[index]
+        element = soup.find(name, attrs=attrs)  # find the first page element that matches the criteria
+        return element.get_text(strip=True) if element is not None else None
+    return rules.resolve(find)
+
+
+def _parse_with_html_parser(html: str, rules: ExtractionRules) -> Tuple[Match, ...]:
+    return _find_in_soup(BeautifulSoup(html, 'html.parser'), rules)
+
+
+def _parse_with_strainer(html: str, rules: ExtractionRules) -> Tuple[Match, ...]:
+    # Only the elements of the selected tags (and their contents) are turned into objects
+    return _find_in_soup(BeautifulSoup(html, 'html.parser', parse_only=rules.strainer), rules)
+
+
+class TargetSpanParser(HTMLParser):
+    """
+    An incremental parser that builds no tree and only collects the text of the first element matching each of the
+    given selectors. `done` turns True as soon as the elements of the selectors at the stop_after positions (by
+    default the first, preferred one) are complete, so callers feeding the page in chunks can stop there. The text
+    is joined the same way as BeautifulSoup's get_text(strip=True), and elements are closed the way BeautifulSoup
+    closes them. A partial parser is fed the page from the middle; it sets `unbalanced` when an end tag may have
+    closed an element that was opened before, which only a parse from the start can tell.
+    """
+
+    VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+                               'track', 'wbr'))
+
+    def __init__(self, selectors: Sequence[Selector], stop_after: Sequence[int] = (0,), partial: bool = False):
+        super().__init__(convert_charrefs=True)
+        self.selectors = selectors
+        self.stop_after = stop_after
+        self.partial = partial
+        self.by_tag: Dict[Optional[str], List[int]] = {}
+        for index, selector in enumerate(selectors):
+            self.by_tag.setdefault(selector.tag, []).append(index)
+        self.any_tag = self.by_tag.pop(None, [])
+        self.found: Dict[int, str] = {}
+        self.open: List[str] = []  # the tags of the open elements, innermost last
+        self.captures: Dict[int, list] = {}  # selector index -> [position of the element in open, text segments]
+        self.unbalanced = False
+        self.closed_void: List[str] = []  # void elements written without '/>', whose end tags are ignored
+        self.raw_text_tag = None
+        self.in_text = False
+
+    @property
+    def done(self) -> bool:
+        return all(index in self.found for index in self.stop_after)
+
+    def result(self) -> Optional[str]:
+        """
+        Returns the text of the most preferred selector found so far.
+        """
+        return self.match()[0]
+
+    def match(self) -> Match:
+        """
+        Returns the text of the most preferred selector found so far, and the index of that selector.
+        """
+        for index in range(len(self.selectors)):
+            if index in self.found:
+                return self.found[index] or None, index
+        return None, None
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag in self.VOID_ELEMENTS:
+            self.closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag not in self.VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def _start(self, tag, attrs):
+        self.in_text = False
+        if tag in ('script', 'style'):
+            self.raw_text_tag = tag
+        void = tag in self.VOID_ELEMENTS
+        if not void:
+            self.open.append(tag)
+        candidates = self.by_tag.get(tag)
+        if candidates is None and not self.any_tag:
+            return
+        attributes = dict(attrs)
+        for index in (candidates or []) + self.any_tag:
+            selector = self.selectors[index]
+            if index not in self.found and index not in self.captures \
+                    and attributes.get(selector.attribute) == selector.value:
+                if void:
+                    self.found[index] = ''
+                else:
+                    self.captures[index] = [len(self.open) - 1, []]
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            self.closed_void.remove(tag)
+            return
+        self.in_text = False
+        if tag == self.raw_text_tag:
+            self.raw_text_tag = None
+        # As in BeautifulSoup, an end tag closes the innermost open element with its name and every element inside
+        # that one, and is ignored if there is none
+        for position in range(len(self.open) - 1, -1, -1):
+            if self.open[position] == tag:
+                break
+        else:
+            if self.partial and self.captures:
+                # It may close an element opened before the part of the page that was fed
+                self.unbalanced = True
+            return
+        del self.open[position:]
+        for index, (opened_at, _) in list(self.captures.items()):
+            if opened_at >= position:
+                self._finish(index)
+
+    def handle_data(self, data):
+        if self.raw_text_tag is not None or not self.captures:
+            return
+        for _, segments in self.captures.values():
+            # Text split across feed() calls still belongs to one text node
+            if self.in_text and segments:
+                segments[-1] += data
+            else:
+                segments.append(data)
+        self.in_text = True
+
+    def handle_comment(self, data):
+        self.in_text = False
+
+    def close(self):
+        super().close()
+        # Unclosed elements run to the end of the document, as they do in BeautifulSoup
+        for index in list(self.captures):
+            self._finish(index)
+
+    def _finish(self, index: int) -> None:
+        _, segments = self.captures.pop(index)
+        self.found[index] = ''.join(segment.strip() for segment in segments)
+
+
+def _parse_targeted(html: str, rules: ExtractionRules, chunk_size: int = 8192) -> Tuple[Match, ...]:
+    # Jump straight to the first candidate tag with a regular expression and parse from there, a chunk at a time,
+    # until the element is closed. The rest of the page is never tokenized, unless the element turns out to be
+    # closed by an end tag whose start tag came before it.
+    def find(index: int) -> Optional[str]:
+        for match in rules.patterns[index].finditer(html):
+            if match.group('target') is not None:
+                break
+        else:
+            return None
+        parser = TargetSpanParser([rules.selectors[index]], partial=True)
+        for start in range(match.start(), len(html), chunk_size):
+            parser.feed(html[start:start + chunk_size])
+            if parser.done or parser.unbalanced:
+                break
+        else:
+            parser.close()
+        if parser.unbalanced:
+            parser = TargetSpanParser([rules.selectors[index]])
+            parser.feed(html)
+            parser.close()
+        return parser.found.get(0)
+    return rules.resolve(find)
+
+
+def _parse_with_lxml(html: str, rules: ExtractionRules) -> Tuple[Match, ...]:
+    if lxml is None:
+        raise ImportError("lxml is required for the 'lxml' parser backend. Install it with 'pip install lxml'.")
+    selectors = rules.xpaths()
+    if not html.strip():
+        return rules.resolve(lambda index: None)
+    try:
+        # document_fromstring always gives the <html> element, where fromstring gives a comment or processing
+        # instruction for a page that starts with text followed by one
+        root = lxml.html.document_fromstring(html.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+    except lxml.etree.ParserError:  # nothing but comments or whitespace
+        return rules.resolve(lambda index: None)
+
+    def find(index: int) -> Optional[str]:
+        matches = selectors[index](root)
+        if not matches:
+            return None
+        # Same as BeautifulSoup's get_text(strip=True): every text node stripped, scripts and styles left out
+        return ''.join(t.strip() for t in matches[0].xpath('.//text()[not(parent::script or parent::style)]'))
+    return rules.resolve(find)
+
+
+def _parse_with_selectolax(html: str, rules: ExtractionRules) -> Tuple[Match, ...]:
+    if SelectolaxParser is None:
+        raise ImportError("selectolax is required for the 'selectolax' parser backend. Install it with "
+                          "'pip install selectolax'.")
+    tree = SelectolaxParser(html)
+
+    def find(index: int) -> Optional[str]:
+        node = tree.css_first(rules.css[index])
+        if node is None:
+            return None
+        if node.css_first('script, style') is not None:
+            node.strip_tags(['script', 'style'])
+        return node.text(deep=True, separator='', strip=True)
+    return rules.resolve(find)
+
+
+PARSER_BACKENDS = {
+    'html.parser': _parse_with_html_parser,
+    'strainer': _parse_with_strainer,
+    'targeted': _parse_targeted,
+    'lxml': _parse_with_lxml,
+    'selectolax': _parse_with_selectolax,
+}
+
+
+def parse_value_from_html(html: str, parser: str = 'html.parser') -> Optional[str]:
+    """
+    Parses a page and extracts the requested value, trying the primary element first and the fallback element second.
+
+    Args:
+        html (str): The page content.
+        parser (str): The parser backend, one of PARSER_BACKENDS. 'html.parser' is BeautifulSoup's pure-Python
+            parser. 'strainer' lets BeautifulSoup build only the elements of the selected tags. 'targeted' locates
+            the elements with a regular expression and parses nothing but them. 'lxml' and 'selectolax' are
+            C-accelerated. They agree on well-formed pages, but follow different rules for broken or unusual
+            markup:
+            'strainer' does not see the elements around the selected ones, so in misnested markup a selected
+            element left open runs on past the end of its parent.
+            'lxml' turns a stray end tag such as </p> into an empty element and keeps the whitespace next to it
+            ('12 </p>x' gives '12 x' instead of '12x').
+            'lxml' and 'selectolax' read the content of a <textarea> as text, markup included, where the others
+            parse the tags in it.
+            'lxml' drops a <td> outside of a table, together with the selected element around it, and 'selectolax'
+            keeps the whitespace around it.
+            Only 'html.parser' and 'strainer' keep the content of a CDATA section.
+            Defaults to 'html.parser'.
+
+    Returns:
+        Optional[str]: The extracted text. Returns None if neither element is present.
+    """
+    return parse_match_from_html(html, parser)[0]
+
+
+def parse_match_from_html(html: str, parser: str = 'html.parser') -> Match:
+    """
+    Same as parse_value_from_html, but also returns the index in DEFAULT_EXTRACTION_RULES['results'] of the element
+    the value was taken from, or None if neither element is present.
+    """
+    return parse_matches_from_html(html, parser)[0]
+
+
+def parse_matches_from_html(html: str, parser: str = 'html.parser',
+                            rules: Optional[ExtractionRules] = None) -> Tuple[Match, ...]:
+    """
+    Parses a page once and extracts every field of the extraction rules.
+
+    Args:
+        html (str): The page content.
+        parser (str): The parser backend, see parse_value_from_html.
+        rules (Optional[ExtractionRules]): The fields to extract. Defaults to DEFAULT_EXTRACTION_RULES.
+
+    Returns:
+        Tuple[Match, ...]: The Match of every field, in the order of rules.fields.
+    """
+    try:
+        backend = PARSER_BACKENDS[parser]
+    except KeyError:
+        raise ValueError(f"Unknown parser backend '{parser}'. Choose one of: {', '.join(PARSER_BACKENDS)}.")
+    return backend(html, rules or _DEFAULT_RULES)
+
+
+class ExtractionCache:
+    """
+    Memoizes extracted values by a hash of the page content, the parser backend and the extraction rules, so pages
+    that come back byte-identical (between runs, or for different URLs) skip parsing. It stores the Match of every
+    field, so the element a value came from is known for cached pages too. It keeps a bounded LRU in memory and,
+    optionally, an SQLite store on disk that outlives the run. None results are cached as well. The on-disk store
+    runs in WAL mode; new entries are written in batches of commit_every, outside the lock of the in-memory LRU,
+    and the rest at close().
+
+    Args:
+        max_entries (int): The number of entries kept in memory. Defaults to 10000.
+        path (Optional[str]): The SQLite file of the on-disk store. Defaults to None, which keeps the cache in
+            memory only.
+        commit_every (int): The number of new entries written to the on-disk store per transaction. Defaults to 100.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None, commit_every: int = 100):
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.entries: 'OrderedDict[str, Tuple[Match, ...]]' = OrderedDict()
+        self.pending: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, matches TEXT)")
+            self.db.commit()
+
+    @staticmethod
+    def key(html: str, parser: str, rules: Optional[ExtractionRules] = None) -> str:
+        return ExtractionCache._key(html.encode('utf-8', 'surrogatepass'), parser, rules)
+
+    @staticmethod
+    def body_key(body: bytes, encoding: Optional[str], parser: str, rules: Optional[ExtractionRules] = None) -> str:
+        """
+        The key of a page given as the body it was downloaded as and its encoding, see _decode_body. A UTF-8 body is
+        hashed without decoding it, which gives the same key as its text.
+        """
+        try:
+            utf8 = codecs.lookup(encoding or 'utf-8').name == 'utf-8'
+        except LookupError:
+            utf8 = True
+        if not utf8:
+            return ExtractionCache.key(_decode_body(body, encoding), parser, rules)
+        return ExtractionCache._key(body, parser, rules)
+
+    @staticmethod
+    def _key(content: bytes, parser: str, rules: Optional[ExtractionRules]) -> str:
+        digest = hashlib.sha256(f"{parser}\0{(rules or _DEFAULT_RULES).fingerprint}\0".encode('utf-8'))
+        digest.update(content)
+        return digest.hexdigest()
+
+    def lookup(self, key: str) -> Tuple[bool, Tuple[Match, ...]]:
+        """
+        Returns whether the key is cached, and its Matches.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            stored = self.pending.get(key)
+        if stored is None and self.db is not None:
+            with self.db_lock:
+                row = self.db.execute("SELECT matches FROM extractions WHERE key = ?", (key,)).fetchone()
+            stored = row[0] if row is not None else None
+        if stored is None:
+            return False, ()
+        value = tuple(tuple(match) for match in json.loads(stored))
+        with self.lock:
+            self.hits += 1
+            self._remember(key, value)
+        return True, value
+
+    def store(self, key: str, value: Tuple[Match, ...]) -> None:
+        batch = None
+        with self.lock:
+            self.misses += 1
+            self._remember(key, value)
+            if self.db is not None:
+                self.pending[key] = json.dumps(value, ensure_ascii=False)
+                if len(self.pending) >= self.commit_every:
+                    batch, self.pending = self.pending, {}
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: Dict[str, str]) -> None:
+        with self.db_lock:
+            self.db.executemany("INSERT OR REPLACE INTO extractions (key, matches) VALUES (?, ?)", batch.items())
+            self.db.commit()
+
+    def _remember(self, key: str, value: Tuple[Match, ...]) -> None:
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def extract(self, html: str, parser: str = 'html.parser', rules: Optional[ExtractionRules] = None,
+                parse: Callable[..., Tuple[Match, ...]] = parse_matches_from_html) -> Tuple[Match, ...]:
+        """
+        Returns the Matches of the page, parsing it with parse only if the same content has not been seen before.
+        """
+        key = self.key(html, parser, rules)
+        found, value = self.lookup(key)
+        if not found:
+            value = parse(html, parser, rules)
+            self.store(key, value)
+        return value
+
+    def close(self) -> None:
+        if self.db is not None:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if batch:
+                self._write(batch)
+            self.db.close()
+            self.db = None
+
+
+class SelectorStats:
+    """
+    Learns for every host which of each field's selectors gives the value, so that the pages of that host try the
+    likeliest selector first. Once a host has min_pages pages, its selectors are ordered by the number of pages
+    they gave the value on, the declared order breaking ties. The learned order is also the precedence: a page
+    that holds several of a field's elements gives the value of the one tried first. Every explore_every-th page of
+    a host is still extracted in the declared order, so that the counts keep following the preferred elements. The
+    counts can be kept in a JSON file across runs; counts learned with different rules are discarded.
+
+    Args:
+        rules (ExtractionRules): The extraction rules of the run.
+        path (Optional[str]): The JSON file the counts are loaded from and saved to. Defaults to None.
+        min_pages (int): The number of pages of a host before its order is learned. Defaults to 20.
+        explore_every (int): The interval of the pages extracted in the declared order. 0 disables them.
+            Defaults to 20.
+    """
+
+    def __init__(self, rules: ExtractionRules, path: Optional[str] = None, min_pages: int = 20,
+                 explore_every: int = 20):
+        self.rules = rules
+        self.path = path
+        self.min_pages = min_pages
+        self.explore_every = explore_every
+        self.lock = threading.Lock()
+        self.learned: Dict[str, ExtractionRules] = {}
+        self.requests: Dict[str, int] = {}
+        self.hosts: Dict[str, dict] = self._load()  # host -> pages, and per field the pages of every selector
+        for host, stats in self.hosts.items():
+            self._learn(host, stats)
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except ValueError:
+            state = {}
+        if state.get('rules') != self.rules.fingerprint:
+            logging.warning(f"Selector statistics {self.path} belong to different extraction rules. Starting from "
+                            "scratch.")
+            return {}
+        return state['hosts']
+
+    def rules_for(self, url: str) -> ExtractionRules:
+        """
+        Returns the rules to extract the page of url with.
+        """
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            count = self.requests.get(host, 0)
+            self.requests[host] = count + 1
+            if self.explore_every and count % self.explore_every == 0:
+                return self.rules
+            return self.learned.get(host, self.rules)
+
+    def record(self, url: str, rules: ExtractionRules, matches: Tuple[Match, ...]) -> None:
+        """
+        Counts the selectors that gave the values of a page extracted with rules, as returned by rules_for.
+        """
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            stats = self.hosts.setdefault(host, {'pages': 0, 'hits': [[0] * len(indexes)
+                                                                      for indexes in self.rules.field_indexes]})
+            stats['pages'] += 1
+            for (_, declared), (_, used), hits, (_, target) in zip(self.rules.spec, rules.spec, stats['hits'], matches):
+                if target is not None:
+                    hits[declared.index(used[target])] += 1
+            self._learn(host, stats)
+
+    def _learn(self, host: str, stats: dict) -> None:
+        if stats['pages'] < self.min_pages:
+            return
+        # sorted() is stable, so selectors with the same count keep their declared order
+        rules = self.rules.reordered([sorted(range(len(hits)), key=lambda index: -hits[index])
+                                      for hits in stats['hits']])
+        if rules.spec != self.learned.get(host, self.rules).spec:
+            logging.info("Selector order for %s: %s", host, {name: list(selectors) for name, selectors in rules.spec})
+            self.learned[host] = rules
+
+    def save(self) -> None:
+        """
+        Replaces the JSON file, if any, with the current counts atomically.
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self.lock, tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False,
+                                                    encoding='utf-8') as f:
+            json.dump({'rules': self.rules.fingerprint, 'hosts': self.hosts}, f, ensure_ascii=False)
+        os.replace(f.name, self.path)
+
+
+def _decode_body(body: bytes, encoding: Optional[str]) -> str:
+    """
+    Decodes a downloaded page the way requests' Response.text does: undecodable bytes are replaced, and an unknown
+    encoding falls back to UTF-8.
+    """
+    try:
+        return body.decode(encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+
+def _parse_body(body: bytes, encoding: Optional[str], parser: str,
+                rules: Optional[ExtractionRules]) -> Tuple[Match, ...]:
+    return parse_matches_from_html(_decode_body(body, encoding), parser, rules)
+
+
+class ParsePool:
+    """
+    Parses pages (see parse_matches_from_html) in a pool of worker processes, so that parsing is not bound by the
+    GIL of the process that fetches them. Pages are handed over as the bytes they were downloaded as, and decoded by
+    the worker. submit returns a Future of the Matches at once, so the fetcher can go on with the next page. At most
+    max_pending pages are queued for the pool; further fetchers block until there is room, so a slow parse stage
+    holds back fetching instead of buffering pages in memory.
+
+    Args:
+        workers (Optional[int]): The number of worker processes. Defaults to the number of CPUs.
+        max_pending (Optional[int]): The number of pages handed over but not yet parsed. Defaults to twice the
+            number of workers.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        # Worker processes are spawned rather than forked, because forking a process that runs threads can
+        # leave locks held in the child
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.max_pending = max_pending or 2 * self.workers
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.async_slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, body: bytes, encoding: Optional[str], parser: str = 'html.parser',
+               rules: Optional[ExtractionRules] = None) -> 'Future[Tuple[Match, ...]]':
+        """
+        Hands a page over to the pool, given as its body and encoding (see _decode_body). Blocks while max_pending
+        pages are waiting, and returns a Future of the Matches of the page.
+        """
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(_parse_body, body, encoding, parser, rules)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def parse(self, html: str, parser: str = 'html.parser',
+              rules: Optional[ExtractionRules] = None) -> Tuple[Match, ...]:
+        return self.submit(html.encode('utf-8', 'surrogatepass'), 'utf-8', parser, rules).result()
+
+    async def async_parse(self, body: bytes, encoding: Optional[str], parser: str = 'html.parser',
+                          rules: Optional[ExtractionRules] = None) -> Tuple[Match, ...]:
+        if self.async_slots is None:
+            self.async_slots = asyncio.Semaphore(self.max_pending)
+        async with self.async_slots:
+            return await asyncio.wrap_future(self.executor.submit(_parse_body, body, encoding, parser, rules))
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self) -> 'ParsePool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _parse(html: str, parser: str, extraction_cache: Optional[ExtractionCache],
+           rules: Optional[ExtractionRules] = None) -> Tuple[Match, ...]:
+    if extraction_cache is not None:
+        return extraction_cache.extract(html, parser, rules)
+    return parse_matches_from_html(html, parser, rules)
+
+
+async def _async_parse(html: str, parser: str, extraction_cache: Optional[ExtractionCache],
+                       parse_pool: Optional[ParsePool] = None, rules: Optional[ExtractionRules] = None,
+                       body: Optional[bytes] = None, encoding: Optional[str] = None) -> Tuple[Match, ...]:
+    """
+    Asyncio counterpart of _parse. The page is parsed by the parse pool if there is one, and otherwise in a thread of
+    the default executor, so that the event loop keeps serving the other requests. The pool is handed the body and
+    encoding of a downloaded page if they are given, and html encoded as UTF-8 otherwise. The extraction cache is
+    also only read and written from threads, as it may have to go to its SQLite file.
+    """
+    if parse_pool is None:
+        return await asyncio.to_thread(_parse, html, parser, extraction_cache, rules)
+    if body is None:
+        body, encoding = html.encode('utf-8', 'surrogatepass'), 'utf-8'
+    if extraction_cache is None:
+        return await parse_pool.async_parse(body, encoding, parser, rules)
+    key = extraction_cache.key(html, parser, rules)
+    found, value = await asyncio.to_thread(extraction_cache.lookup, key)
+    if not found:
+        value = await parse_pool.async_parse(body, encoding, parser, rules)
+        await asyncio.to_thread(extraction_cache.store, key, value)
+    return value
+
+
+def _new_stream_decoder(encoding: Optional[str]) -> codecs.IncrementalDecoder:
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def _extract_from_stream(response: requests.Response, rules: ExtractionRules,
+                         chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[Match, ...]:
+    """
+    Reads a streamed response chunk by chunk into a TargetSpanParser and stops downloading once the preferred
+    element of every field is complete. Pages that lack one of them are read to the end, because the preferred
+    element takes precedence wherever it appears.
+    """
+    decoder = _new_stream_decoder(response.encoding)
+    parser = TargetSpanParser(rules.selectors, rules.preferred)
+    received = 0
+    with _measure_download():
+        for chunk in response.iter_content(chunk_size):
+            received += len(chunk)
+            with _measure('parse'):
+                parser.feed(decoder.decode(chunk))
+            if parser.done:
+                logging.debug("Stopped reading %s after %d bytes.", response.url, received,
+                              extra={'url': str(response.url)})
+                break
+        else:
+            with _measure('parse'):
+                parser.feed(decoder.decode(b'', final=True))
+                parser.close()
+    _add_bytes(received)
+    return rules.resolve(parser.found.get)
+
+
+async def _async_extract_from_stream(response: 'aiohttp.ClientResponse', rules: ExtractionRules,
+                                     chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[Match, ...]:
+    """
+    Asyncio counterpart of _extract_from_stream.
+    """
+    decoder = _new_stream_decoder(response.charset)
+    parser = TargetSpanParser(rules.selectors, rules.preferred)
+    received = 0
+    with _measure_download():
+        async for chunk in response.content.iter_chunked(chunk_size):
+            received += len(chunk)
+            with _measure('parse'):
+                parser.feed(decoder.decode(chunk))
+            if parser.done:
+                logging.debug("Stopped reading %s after %d bytes.", response.url, received,
+                              extra={'url': str(response.url)})
+                break
+        else:
+            with _measure('parse'):
+                parser.feed(decoder.decode(b'', final=True))
+                parser.close()
+    _add_bytes(received)
+    return rules.resolve(parser.found.get)
+
+
+def _failed(message: str) -> str:
+    """
+    Counts a URL that ends with an error, and passes the error message through.
+    """
+    _metric_inc('scraper_failures_total')
+    return message
+
+
+def _log_extraction(url_to_scrape: str, matches: Tuple[Match, ...], rules: ExtractionRules,
+                    selector_stats: Optional[SelectorStats] = None) -> Extracted:
+    """
+    Logs the outcome of an extraction and returns the extracted value, or with several fields a dict of the values
+    by field name.
+    """
+    if selector_stats is not None:
+        selector_stats.record(url_to_scrape, rules, matches)
+    values = {}
+    for field, indexes, (value, target) in zip(rules.fields, rules.field_indexes, matches):
+        values[field] = value
+        _metric_inc('scraper_extractions_total', field=field,
+                    element=rules.selectors[indexes[target]].value if target is not None else 'none')
+    extracted = values[rules.fields[0]] if len(values) == 1 else values
+    if any(values.values()):
+        logging.info("Successfully extracted: %s", extracted, extra={'url': url_to_scrape})
+        return extracted
+    logging.warning("Could not extract data for %s (element not found).", url_to_scrape, extra={'url': url_to_scrape})
+    return None
+
+
+def _cached_response(url_to_scrape: str,
+                     response_cache: Optional[ResponseCache]) -> Tuple[Optional[CachedResponse], bool]:
+    """
+    Returns the cached response of the URL, if any, and whether it is fresh enough to be used without a request.
+    """
+    cached = response_cache.get(url_to_scrape) if response_cache is not None else None
+    fresh = cached is not None and response_cache.is_fresh(cached)
+    if fresh:
+        logging.info("Using cached response for %s", url_to_scrape, extra={'url': url_to_scrape})
+    return cached, fresh
+
+
+def _not_modified(url_to_scrape: str, cached: CachedResponse, response_cache: ResponseCache) -> str:
+    """
+    Handles a 304 response to a revalidation: the cached page is fresh again. Returns its text.
+    """
+    logging.info("Not modified since cached: %s", url_to_scrape, extra={'url': url_to_scrape})
+    response_cache.refresh(url_to_scrape, cached)
+    return cached.text
+
+
+def _keep_response(url_to_scrape: str, html: Optional[str], status: int, reason: Optional[str],
+                   headers: Iterable[Tuple[str, str]], body: bytes, encoding: Optional[str],
+                   archive: Optional[ResponseArchive], response_cache: Optional[ResponseCache]) -> None:
+    """
+    Appends a page downloaded in full to the archive and stores it in the response cache, if they are given. html
+    is only used by the response cache.
+    """
+    headers = list(headers)
+    if archive is not None:
+        archive.write(url_to_scrape, status, reason, headers, body, encoding)
+    if response_cache is not None:
+        header = {name.lower(): value for name, value in headers}
+        response_cache.store(url_to_scrape, html, header.get('etag'), header.get('last-modified'))
+
+
+def _failed_attempt(url_to_scrape: str, policy: RetryPolicy, attempt: int, error: BaseException, kind: str,
+                    status_code=None, retry_after: Optional[str] = None) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Logs a failed attempt to fetch a URL, and decides whether to retry it. kind is 'http' for an error status,
+    'timeout', 'connection' for connection and payload errors, 'request' for other client errors, or 'unexpected'.
+
+    Returns:
+        Tuple[Optional[float], Optional[str]]: The number of seconds to wait before the next attempt and None, or
+            None and the error message (see ERROR_PREFIXES) the URL ends with.
+    """
+    extra = {'url': url_to_scrape}
+    if kind == 'http':
+        extra['status'] = status_code
+        logging.error("HTTP Error for %s: %s - Status: %s", url_to_scrape, error, status_code, extra=extra)
+        if not policy.should_retry(attempt, status_code):
+            # If the status is not retried, or no more retries are left
+            return None, _failed(f"HTTP Error: {status_code} (Attempt {attempt + 1})")
+        delay = policy.delay(attempt, status_code, retry_after)
+        logging.info("Received %s. Waiting %.1f seconds before retrying (Attempt %d failed)...", status_code,
+                     delay, attempt + 1, extra=extra)
+    elif kind in ('timeout', 'connection'):
+        if kind == 'timeout':
+            logging.error("Request Timeout for %s.", url_to_scrape, extra=extra)
+        else:
+            logging.error("Connection Error for %s: %s", url_to_scrape, error, extra=extra)
+        if not policy.should_retry(attempt):
+            return None, _failed("Request Timeout" if kind == 'timeout' else f"Request Exception: {str(error)}")
+        delay = policy.delay(attempt)
+        logging.info("Waiting %.1f seconds before retrying due to %s...", delay,
+                     'timeout' if kind == 'timeout' else 'connection error', extra=extra)
+    elif kind == 'request':
+        logging.error("Request Exception for %s: %s", url_to_scrape, error, extra=extra)
+        return None, _failed(f"Request Exception: {str(error)}")
+    else:
+        logging.error("An unexpected error occurred for %s: %s", url_to_scrape, error, exc_info=error, extra=extra)
+        return None, _failed(f"Unexpected Error: {str(error)}")
+    _metric_inc('scraper_retries_total')
+    return delay, None
+
+
+def _extract_page(url_to_scrape: str, policy: RetryPolicy, attempt: int, html: Optional[str],
+                  body: Optional[bytes] = None, encoding: Optional[str] = None, *, parser: str,
+                  extraction_cache: Optional[ExtractionCache], parse_pool: Optional[ParsePool], rules: ExtractionRules,
+                  selector_stats: Optional[SelectorStats]) -> Union[Extracted, 'Future[Extracted]']:
+    """
+    Extracts the value from a page fetched by extract_value_from_url, given as its text, or as the body and encoding
+    it was downloaded with. Without a parse pool the page is parsed at once. With one, the body is handed to the
+    pool and a Future of the value is returned instead, so the thread that fetched the page can go on with the next
+    one. The value is then completed in the thread that receives the results of the pool.
+    """
+    if parse_pool is None:
+        with _measure('parse'):
+            matches = _parse(html if html is not None else _decode_body(body, encoding), parser, extraction_cache,
+                             rules)
+        return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+    if body is None:
+        body, encoding = html.encode('utf-8', 'surrogatepass'), 'utf-8'
+    key = None
+    if extraction_cache is not None:
+        key = extraction_cache.body_key(body, encoding, parser, rules)
+        found, matches = extraction_cache.lookup(key)
+        if found:
+            return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+    start = time.perf_counter()
+
+    def parsed(parse: Future) -> Extracted:
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.add('parse', time.perf_counter() - start)
+        try:
+            matches = parse.result()
+        except Exception as e:
+            return _failed_attempt(url_to_scrape, policy, attempt, e, 'unexpected')[1]
+        if key is not None:
+            extraction_cache.store(key, matches)
+        return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+
+    return _then(parse_pool.submit(body, encoding, parser, rules), parsed)
+
+
+def extract_value_from_url(url_to_scrape: str, max_retries: int = 1, retry_delay: int = 5,
+                           session: Optional[requests.Session] = None,
+                           rate_limiter: Optional[HostRateLimiter] = None,
+                           retry_policy: Optional[RetryPolicy] = None, parser: str = 'html.parser',
+                           stream: bool = False, response_cache: Optional[ResponseCache] = None,
+                           extraction_cache: Optional[ExtractionCache] = None,
+                           parse_pool: Optional[ParsePool] = None,
+                           timing: Optional[RequestTiming] = None,
+                           metrics: Optional[Metrics] = None,
+                           archive: Optional[ResponseArchive] = None,
+                           rules: Optional[ExtractionRules] = None,
+                           selector_stats: Optional[SelectorStats] = None) -> Extracted:
+    """
+    Extracts the requested value from a given URL. Retries 403/429/5xx responses, timeouts and connection errors
+    according to the retry policy.
+
+    Parameters:
+        url_to_scrape (str): The URL to scrape.
+        max_retries (int): The maximum number of retries. Ignored if retry_policy is given.
+        retry_delay (int): The base delay in seconds between retries. Ignored if retry_policy is given.
+        session (Optional[requests.Session]): A pooled session from create_session. Retries reuse its connections.
+            Without a session every attempt opens a new connection.
+        rate_limiter (Optional[HostRateLimiter]): Limits the request rate per host. Every attempt takes a token.
+        retry_policy (Optional[RetryPolicy]): The retry policy. Defaults to exponential backoff with full jitter
+            built from max_retries and retry_delay.
+        parser (str): The parser backend used to extract the value, see parse_value_from_html.
+        stream (bool): Whether to read the body in chunks into an incremental parser and drop the connection as
+            soon as the value is found. The parser backend is not used in this mode.
+        response_cache (Optional[ResponseCache]): Serves fresh cached pages without a request and revalidates stale
+            ones. Streamed responses are not stored, because their body is not read to the end.
+        extraction_cache (Optional[ExtractionCache]): Skips parsing for page content that has been parsed before.
+        parse_pool (Optional[ParsePool]): Parses the page in a worker process. Streamed pages are parsed as they
+            arrive, without the pool.
+        timing (Optional[RequestTiming]): If given, filled in with the time spent in every phase of the request.
+        metrics (Optional[Metrics]): If given, the requests, responses, retries and the outcome are counted in it.
+        archive (Optional[ResponseArchive]): If given, every page downloaded in full is appended to it. Streamed
+            pages are not, because their body is not read to the end.
+        rules (Optional[ExtractionRules]): The fields to extract. Defaults to DEFAULT_EXTRACTION_RULES.
+        selector_stats (Optional[SelectorStats]): If given, the page is extracted with the selector order learned
+            for its host, and the selectors that gave the values are counted in it. Replaces rules.
+
+    Returns:
+        Extracted: The string which gets reversed. Returns None if no data is extracted. With several fields
+            in rules, a dict of the values by field name.
+    """
+    policy = retry_policy or RetryPolicy(max_retries=max_retries, base_delay=retry_delay)
+    result = _extract(url_to_scrape, policy, timing, metrics, session=session, rate_limiter=rate_limiter,
+                      parser=parser, stream=stream, response_cache=response_cache,
+                      extraction_cache=extraction_cache, parse_pool=parse_pool, archive=archive, rules=rules,
+                      selector_stats=selector_stats)
+    return result.result() if isinstance(result, Future) else result
+
+
+def _extract(url_to_scrape: str, policy: RetryPolicy, timing: Optional[RequestTiming] = None,
+             metrics: Optional[Metrics] = None, **kwargs) -> Union[Extracted, 'Future[Extracted]']:
+    """
+    Runs _extract_value_from_url with the timing and metrics of the URL recorded. For a page handed to a parse pool
+    it returns a Future of the value (see _extract_page), which is done once the recording is complete as well.
+    process_urls fetches its rows with it, so that its threads do not wait for the parse pool.
+    """
+    if timing is None and metrics is None:
+        return _extract_value_from_url(url_to_scrape, policy, **kwargs)
+    finish = _start_recording(timing, metrics)
+    result = None
+    try:
+        with _recording_to(timing, metrics):
+            result = _extract_value_from_url(url_to_scrape, policy, **kwargs)
+    finally:
+        if not isinstance(result, Future):
+            finish()
+    if not isinstance(result, Future):
+        return result
+
+    def recorded(extraction: Future) -> Extracted:
+        finish()
+        return extraction.result()
+
+    return _then(result, recorded)
+
+
+def _extract_value_from_url(url_to_scrape: str, policy: RetryPolicy, *, session: Optional[requests.Session],
+                            rate_limiter: Optional[HostRateLimiter], parser: str, stream: bool,
+                            response_cache: Optional[ResponseCache], extraction_cache: Optional[ExtractionCache],
+                            parse_pool: Optional[ParsePool], archive: Optional[ResponseArchive],
+                            rules: Optional[ExtractionRules],
+                            selector_stats: Optional[SelectorStats]) -> Union[Extracted, 'Future[Extracted]']:
+    """
+    The body of extract_value_from_url, see _extract.
+    """
+    rules = selector_stats.rules_for(url_to_scrape) if selector_stats is not None else rules or _DEFAULT_RULES
+    page = partial(_extract_page, url_to_scrape, policy, parser=parser, extraction_cache=extraction_cache,
+                   parse_pool=parse_pool, rules=rules, selector_stats=selector_stats)
+    cached, fresh = _cached_response(url_to_scrape, response_cache)
+    if fresh:
+        return page(0, cached.text)
+
+    for attempt in range(policy.max_retries + 1):
+        logging.info("Processing URL: %s (Attempt: %d of %d", url_to_scrape, attempt + 1, policy.max_retries + 1,
+                     extra={'url': url_to_scrape})
+        try:
+            response = _send_request(url_to_scrape, session, rate_limiter, stream,
+                                     ResponseCache.conditional_headers(cached))
+            with response:
+                response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+                if response.status_code == 304 and cached is not None:
+                    html, body, encoding = _not_modified(url_to_scrape, cached, response_cache), None, None
+                elif stream:
+                    return _log_extraction(url_to_scrape, _extract_from_stream(response, rules), rules, selector_stats)
+                else:
+                    body, encoding = response.content, response.encoding or response.apparent_encoding
+                    # A worker of the parse pool decodes the page itself, so it is only decoded here if needed
+                    html = _decode_body(body, encoding) if parse_pool is None or response_cache is not None else None
+                    _keep_response(url_to_scrape, html, response.status_code, response.reason,
+                                   response.headers.items(), body, encoding, archive, response_cache)
+            return page(attempt, html, body, encoding)
+
+        except requests.exceptions.HTTPError as http_err:
+            response = http_err.response
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, http_err, 'http',
+                                             response.status_code if response is not None else 'N/A',
+                                             response.headers.get('Retry-After') if response is not None else None)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError) as conn_err:
+            timed_out = isinstance(conn_err, requests.exceptions.Timeout)
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, conn_err,
+                                             'timeout' if timed_out else 'connection')
+        except requests.exceptions.RequestException as req_err:
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, req_err, 'request')
+        except Exception as e:
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, e, 'unexpected')
+        if failure is not None:
+            return failure
+        time.sleep(delay)
+
+    # If loop finishes without returning
+    return _failed(f"Failed after {policy.max_retries + 1} attempts")
+
+
+async def async_extract_value_from_url(url_to_scrape: str, session: Optional['aiohttp.ClientSession'] = None,
+                                       max_retries: int = 1, retry_delay: int = 5,
+                                       rate_limiter: Optional[HostRateLimiter] = None,
+                                       retry_policy: Optional[RetryPolicy] = None, parser: str = 'html.parser',
+                                       stream: bool = False, response_cache: Optional[ResponseCache] = None,
+                                       extraction_cache: Optional[ExtractionCache] = None,
+                                       parse_pool: Optional[ParsePool] = None,
+                                       timing: Optional[RequestTiming] = None,
+                                       metrics: Optional[Metrics] = None,
+                                       archive: Optional[ResponseArchive] = None,
+                                       rules: Optional[ExtractionRules] = None,
+                                       selector_stats: Optional[SelectorStats] = None) -> Extracted:
+    """
+    Asyncio counterpart of extract_value_from_url. Retries, return values and parsing are the same as in the
+    blocking version.
+
+    Parameters:
+        url_to_scrape (str): The URL to scrape.
+        session (Optional[aiohttp.ClientSession]): The session used for the request. A short-lived session is
+            created when none is given.
+        max_retries (int): The maximum number of retries. Ignored if retry_policy is given.
+        retry_delay (int): The base delay in seconds between retries. Ignored if retry_policy is given.
+        rate_limiter (Optional[HostRateLimiter]): Limits the request rate per host. Every attempt takes a token.
+        retry_policy (Optional[RetryPolicy]): The retry policy. Defaults to exponential backoff with full jitter
+            built from max_retries and retry_delay.
+        parser (str): The parser backend used to extract the value, see parse_value_from_html.
+        stream (bool): Whether to read the body in chunks into an incremental parser and drop the connection as
+            soon as the value is found. The parser backend is not used in this mode.
+        response_cache (Optional[ResponseCache]): Serves fresh cached pages without a request and revalidates stale
+            ones.
+        extraction_cache (Optional[ExtractionCache]): Skips parsing for page content that has been parsed before.
+        parse_pool (Optional[ParsePool]): Parses the page in a worker process instead of the event loop.
+        timing (Optional[RequestTiming]): If given, filled in with the time spent in every phase of the request.
+            Connection setup is only measured if the session was created with _timing_trace_config().
+        metrics (Optional[Metrics]): If given, the requests, responses, retries and the outcome are counted in it.
+        archive (Optional[ResponseArchive]): If given, every page downloaded in full is appended to it.
+        rules (Optional[ExtractionRules]): The fields to extract. Defaults to DEFAULT_EXTRACTION_RULES.
+        selector_stats (Optional[SelectorStats]): If given, the page is extracted with the selector order learned
+            for its host, and the selectors that gave the values are counted in it. Replaces rules.
+
+    Returns:
+        Extracted: The extracted string. Returns None if no data is extracted. With several fields in rules,
+            a dict of the values by field name.
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for the asyncio API. Install it with 'pip install aiohttp'.")
+    extract = partial(_async_extract_value_from_url, url_to_scrape,
+                      retry_policy or RetryPolicy(max_retries=max_retries, base_delay=retry_delay),
+                      rate_limiter=rate_limiter, parser=parser, stream=stream, response_cache=response_cache,
+                      extraction_cache=extraction_cache, parse_pool=parse_pool, archive=archive, rules=rules,
+                      selector_stats=selector_stats)
+    with _recording(timing, metrics) if timing is not None or metrics is not None else nullcontext():
+        if session is not None:
+            return await extract(session=session)
+        trace_configs = [_timing_trace_config()] if timing is not None else None
+        async with aiohttp.ClientSession(headers=DEFAULT_HEADERS, trace_configs=trace_configs) as own_session:
+            return await extract(session=own_session)
+
+
+async def _async_extract_value_from_url(url_to_scrape: str, policy: RetryPolicy, *,
+                                        session: 'aiohttp.ClientSession', rate_limiter: Optional[HostRateLimiter],
+                                        parser: str, stream: bool, response_cache: Optional[ResponseCache],
+                                        extraction_cache: Optional[ExtractionCache], parse_pool: Optional[ParsePool],
+                                        archive: Optional[ResponseArchive], rules: Optional[ExtractionRules],
+                                        selector_stats: Optional[SelectorStats]) -> Extracted:
+    """
+    The body of async_extract_value_from_url, run with the timing and metrics of the URL recorded.
+    """
+    rules = selector_stats.rules_for(url_to_scrape) if selector_stats is not None else rules or _DEFAULT_RULES
+    # The response cache and the archive read and write files, which is done in threads of the default executor
+    cached, fresh = None, False
+    if response_cache is not None:
+        cached, fresh = await asyncio.to_thread(_cached_response, url_to_scrape, response_cache)
+    if fresh:
+        with _measure('parse'):
+            matches = await _async_parse(cached.text, parser, extraction_cache, parse_pool, rules)
+        return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+
+    for attempt in range(policy.max_retries + 1):
+        logging.info("Processing URL: %s (Attempt: %d of %d", url_to_scrape, attempt + 1, policy.max_retries + 1,
+                     extra={'url': url_to_scrape})
+        try:
+            async with _async_request(url_to_scrape, session, rate_limiter,
+                                      ResponseCache.conditional_headers(cached)) as response:
+                if response.status == 304 and cached is not None:
+                    html = await asyncio.to_thread(_not_modified, url_to_scrape, cached, response_cache)
+                    body = encoding = None
+                elif stream:
+                    matches = await _async_extract_from_stream(response, rules)
+                    return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+                else:
+                    with _measure_download():
+                        body = await response.read()
+                        _add_bytes(len(body))
+                    html, encoding = await response.text(), response.get_encoding()
+                    if archive is not None or response_cache is not None:
+                        await asyncio.to_thread(_keep_response, url_to_scrape, html, response.status, response.reason,
+                                                list(response.headers.items()), body, encoding, archive,
+                                                response_cache)
+            with _measure('parse'):
+                matches = await _async_parse(html, parser, extraction_cache, parse_pool, rules, body, encoding)
+            return _log_extraction(url_to_scrape, matches, rules, selector_stats)
+
+        except aiohttp.ClientResponseError as http_err:
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, http_err, 'http', http_err.status,
+                                             http_err.headers.get('Retry-After') if http_err.headers else None)
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as conn_err:
+            timed_out = isinstance(conn_err, asyncio.TimeoutError)
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, conn_err,
+                                             'timeout' if timed_out else 'connection')
+        except aiohttp.ClientError as req_err:
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, req_err, 'request')
+        except Exception as e:
+            delay, failure = _failed_attempt(url_to_scrape, policy, attempt, e, 'unexpected')
+        if failure is not None:
+            return failure
+        await asyncio.sleep(delay)
+
+    return _failed(f"Failed after {policy.max_retries + 1} attempts")
+
+
+def _load_frames(csv_filename: str, random_sample: bool, sample_size: int, chunk_size: Optional[int],
+                 keep_columns: Optional[List[str]]) -> Iterator[pd.DataFrame]:
+    """
+    Yields the input rows as DataFrames: one per chunk if chunk_size is set, otherwise the whole (sampled) file.
+    """
+    columns = ['url'] + [column for column in keep_columns if column != 'url'] if keep_columns else None
+    if chunk_size and not random_sample:
+        return _prefetch(chunk for chunk in iter_csv_chunks(csv_filename, chunk_size, columns) if not chunk.empty)
+    df = import_file(csv_filename, random_sample, sample_size, columns)
+    return iter([df] if not df.empty else [])
+
+
+class ResultWriter:
+    """
+    Appends result rows to a CSV or JSON Lines file in batches. Every batch is flushed and fsynced before the next
+    one is written, so a crash loses at most the rows still in the buffer and memory use does not grow with the
+    size of the run. Use it as a context manager, or call close() to write the last batch.
+
+    Args:
+        filename (str): The output file.
+        output_format (Optional[str]): 'csv' or 'jsonl'. Defaults to 'jsonl' for .jsonl/.ndjson files and 'csv'
+            otherwise.
+        batch_size (int): The number of rows buffered before they are written. Defaults to 100.
+        append (bool): Whether to add to an existing file instead of replacing it. Defaults to False.
+    """
+
+    def __init__(self, filename: str, output_format: Optional[str] = None, batch_size: int = 100,
+                 append: bool = False):
+        if output_format is None:
+            output_format = 'jsonl' if filename.endswith(('.jsonl', '.ndjson')) else 'csv'
+        if output_format not in ('csv', 'jsonl'):
+            raise ValueError(f"Unknown output format '{output_format}'. Choose 'csv' or 'jsonl'.")
+        self.filename = filename
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.append = append
+        self.buffer: List[pd.DataFrame] = []
+        self.buffered_rows = 0
+        self.rows_written = 0
+        self.file = None
+
+    def write(self, rows: pd.DataFrame) -> None:
+        self.buffer.append(rows)
+        self.buffered_rows += len(rows)
+        if self.buffered_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        batch = pd.concat(self.buffer) if len(self.buffer) > 1 else self.buffer[0]
+        if self.file is None:
+            # Opened lazily, so a run without any rows leaves no file behind
+            self.file = open(self.filename, 'a' if self.append else 'w', encoding='utf-8', newline='')
+        if self.output_format == 'csv':
+            batch.to_csv(self.file, index=False, header=self.file.tell() == 0)
+        else:
+            self.file.write(batch.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.rows_written += len(batch)
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                logging.info(f"Updated data saved to {self.filename} ({self.rows_written} rows)")
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def file_hash(filename: str, block_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-256 hex digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    Records every completed row of a run in a JSON Lines file, so that a restarted run skips the rows that are
+    already done and reuses their results. Rows that ended with an error (see ERROR_PREFIXES) are not recorded, so
+    a restarted run fetches them again. The first line holds the hash of the input file, and a checkpoint written
+    for different input is discarded. Rows are identified by their index and URL.
+
+    Args:
+        filename (str): The checkpoint file.
+        input_filename (str): The input CSV file of the run.
+        sync_every (int): The number of records after which the file is fsynced. Defaults to 100.
+    """
+
+    def __init__(self, filename: str, input_filename: str, sync_every: int = 100):
+        self.filename = filename
+        self.input_hash = file_hash(input_filename)
+        self.sync_every = sync_every
+        self.completed: Dict[int, Tuple[str, Extracted]] = self._load()
+        self.file = open(filename, 'a' if self.completed else 'w', encoding='utf-8')
+        if not self.completed:
+            self.file.write(json.dumps({'input_hash': self.input_hash}) + '\n')
+            self.file.flush()
+        self.unsynced = 0
+        self.lock = threading.Lock()
+
+    def _load(self) -> Dict[int, Tuple[str, Extracted]]:
+        if not os.path.exists(self.filename):
+            return {}
+        completed = {}
+        with open(self.filename, encoding='utf-8') as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = {}
+            if header.get('input_hash') != self.input_hash:
+                logging.warning(f"Checkpoint {self.filename} belongs to a different input file. Starting from scratch.")
+                return {}
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # a line cut short by a crash
+                    continue
+                completed[record['row']] = (record['url'], record['result'])
+        logging.info(f"Resuming from checkpoint {self.filename}: {len(completed)} rows already done.")
+        return completed
+
+    def restore(self, indexes: Iterable, urls: np.ndarray, results: np.ndarray) -> np.ndarray:
+        """
+        Copies the recorded results of a frame's rows into results, and returns the mask of the rows that were
+        already completed.
+        """
+        restored = np.zeros(len(urls), dtype=bool)
+        if not self.completed:
+            return restored
+        for position, (index, url) in enumerate(zip(indexes, urls)):
+            record = self.completed.get(int(index))
+            if record is not None and record[0] == url:
+                results[position] = record[1]
+                restored[position] = True
+        return restored
+
+    def record(self, index: int, url: str, result: Extracted) -> None:
+        if isinstance(result, str) and result.startswith(ERROR_PREFIXES):
+            return
+        with self.lock:
+            self.file.write(json.dumps({'row': int(index), 'url': url, 'result': result}, ensure_ascii=False) + '\n')
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def close(self, finished: bool = False) -> None:
+        """
+        Closes the checkpoint. A finished run removes it, so the next run over the same file starts fresh.
+        """
+        self.file.close()
+        if finished:
+            os.remove(self.filename)
+
+
+class _FrameResults:
+    """
+    The column-wise state of one input frame: its URLs, a preallocated results array and the rows still to fetch.
+    Completed rows are passed to a ResultWriter in their original order, whatever the order in which their requests
+    finish: a slice of the frame is built once at least the writer's batch_size rows are complete with every row
+    before them, and finish() passes the rest. Only an active frame passes rows, see _FramePipeline. The results go
+    into one column per extracted field: a row's result is the value of a single field, a dict of the values of
+    several fields, or an error message, which every field column gets. With record_timings, every row to fetch gets
+    a RequestTiming, written out as the RequestTiming.COLUMNS next to the results.
+    """
+
+    def __init__(self, df: pd.DataFrame, writer: ResultWriter, checkpoint: Optional[Checkpoint] = None,
+                 record_timings: bool = False, fields: Sequence[str] = ('results',), active: bool = True):
+        self.df = df
+        self.fields = fields
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.indexes = df.index.to_numpy()
+        self.urls = df['url'].fillna('').astype(str).to_numpy(dtype=object)
+        self.results = np.full(len(df), None, dtype=object)
+        self.completed = np.zeros(len(df), dtype=bool)
+        self.next_position = 0
+        self.ready_end = 0
+        self.active = active
+        self.lock = threading.Lock()
+
+        valid = pd.Series(self.urls).str.strip().ne('').to_numpy()
+        if checkpoint is not None:
+            self.completed |= checkpoint.restore(self.indexes, self.urls, self.results)
+        self.restored = int(self.completed.sum())
+        for position in np.flatnonzero(~valid & ~self.completed):
+            logging.info("Skipped empty or invalid url for row %s.", self.indexes[position] + 1)
+        self.completed |= ~valid
+        self.pending = np.flatnonzero(~self.completed)
+        self.remaining = len(self.pending)
+        self.timings: Optional[np.ndarray] = None
+        if record_timings:
+            self.timings = np.full(len(df), None, dtype=object)
+            self.timings[self.pending] = [RequestTiming() for _ in self.pending]
+        self._emit()
+
+    def complete(self, position: int, result: Extracted) -> None:
+        self.results[position] = result
+        if self.checkpoint is not None:
+            self.checkpoint.record(self.indexes[position], self.urls[position], result)
+        with self.lock:
+            self.completed[position] = True
+            self.remaining -= 1
+            self._emit()
+
+    def activate(self) -> None:
+        with self.lock:
+            self.active = True
+            self._emit()
+
+    def _emit(self, final: bool = False) -> None:
+        if not self.active:
+            return
+        end = self.ready_end
+        while end < len(self.completed) and self.completed[end]:
+            end += 1
+        self.ready_end = end
+        if end - self.next_position >= self.writer.batch_size or (final and end > self.next_position):
+            rows = self.df.iloc[self.next_position:end].assign(**self._result_columns(self.next_position, end))
+            if self.timings is not None:
+                rows = rows.assign(**self._timing_columns(self.next_position, end))
+            self.writer.write(rows)
+            self.next_position = end
+
+    def _result_columns(self, start: int, end: int) -> Dict[str, Sequence]:
+        results = self.results[start:end]
+        if len(self.fields) == 1:
+            return {self.fields[0]: results}
+        return {field: [result.get(field) if isinstance(result, dict) else result for result in results]
+                for field in self.fields}
+
+    def _timing_columns(self, start: int, end: int) -> Dict[str, list]:
+        records = [timing.columns() if timing is not None else {} for timing in self.timings[start:end]]
+        return pd.DataFrame.from_records(records, columns=RequestTiming.COLUMNS).to_dict('list')
+
+    def finish(self) -> None:
+        with self.lock:
+            self._emit(final=True)
+
+
+class _FramePipeline:
+    """
+    The input frames of a run whose rows are being fetched, oldest first. The rows of a frame may be fetched while
+    older frames still wait for their last rows, so a run has no barrier at the end of every frame. Only the oldest
+    frame is active and passes its rows to the writer, which keeps the output in input order; once all its rows
+    are complete it is finished and counted in the summary, and the next frame becomes active. Not thread-safe: the
+    driver of the run calls it from one thread, or from the event loop.
+    """
+
+    def __init__(self, writer: ResultWriter, checkpoint: Optional[Checkpoint], record_timings: bool,
+                 fields: Sequence[str], summary: '_RunSummary'):
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.record_timings = record_timings
+        self.fields = fields
+        self.summary = summary
+        self.frames: 'deque[_FrameResults]' = deque()
+
+    def add(self, df: pd.DataFrame) -> _FrameResults:
+        frame = _FrameResults(df, self.writer, self.checkpoint, self.record_timings, self.fields,
+                              active=not self.frames)
+        self.frames.append(frame)
+        self._finish_completed()
+        return frame
+
+    def complete(self, frame: _FrameResults, position: int, result: Extracted) -> None:
+        frame.complete(position, result)
+        self._finish_completed()
+
+    def _finish_completed(self) -> None:
+        while self.frames and self.frames[0].remaining == 0:
+            frame = self.frames.popleft()
+            frame.finish()
+            self.summary.add(frame)
+            if self.frames:
+                self.frames[0].activate()
+
+
+class _RunSummary:
+    """
+    Counts the outcomes of the rows of a run, frame by frame, for a one-line summary at the end.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.restored = 0
+        self.fetched = 0
+        self.found = 0
+        self.not_found = 0
+        self.errors = 0
+
+    def add(self, frame: '_FrameResults') -> None:
+        results = pd.Series(frame.results[frame.pending], dtype=object)
+        errors = int(results.str.startswith(ERROR_PREFIXES, na=False).sum())
+        not_found = int(results.isna().sum())
+        self.rows += len(frame.results)
+        self.restored += frame.restored
+        self.fetched += len(results)
+        self.errors += errors
+        self.not_found += not_found
+        self.found += len(results) - errors - not_found
+
+    def log(self, duplicates: Optional[int] = None) -> None:
+        elapsed = time.perf_counter() - self.started
+        fields = {'rows': self.rows, 'fetched': self.fetched, 'found': self.found, 'not_found': self.not_found,
+                  'errors': self.errors, 'restored': self.restored,
+                  'skipped': self.rows - self.fetched - self.restored, 'elapsed_seconds': round(elapsed, 3)}
+        if duplicates is not None:
+            fields['duplicates'] = duplicates
+        logging.info("Run complete: %d rows, %d fetched (%d values, %d not found, %d errors), %d restored from the "
+                     "checkpoint, %d skipped in %.1f seconds (%.1f rows/s).", self.rows, self.fetched, self.found,
+                     self.not_found, self.errors, self.restored, fields['skipped'], elapsed,
+                     self.rows / elapsed if elapsed else 0.0, extra=fields)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns a canonical form of a URL, so that trivially different variants of the same page compare equal:
+    scheme and host are lowercased, default ports and fragments dropped, a trailing slash removed from the path,
+    tracking parameters (utm_* and TRACKING_PARAMS) removed and the remaining query parameters sorted by name. The
+    values of a repeated parameter keep their order, and user name and password their case.
+
+    Args:
+        url (str): The URL to normalize.
+
+    Returns:
+        str: The canonical URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition('@')
+    host = host.lower()
+    if (scheme == 'http' and host.endswith(':80')) or (scheme == 'https' and host.endswith(':443')):
+        host = host.rsplit(':', 1)[0]
+    path = parts.path.rstrip('/') or '/'
+    # Sorted by name only: the sort is stable, so the values of a repeated parameter keep their order
+    query = sorted(((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                    if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS),
+                   key=lambda item: item[0])
+    return urlunsplit((scheme, userinfo + at + host, path, urlencode(query), ''))
+
+
+class UrlDeduplicator:
+    """
+    Makes sure every canonical URL (see normalize_url) is fetched only once per run. The first row with a given
+    canonical URL fetches it. Every later row with the same canonical URL gets the same result, and waits for it
+    if the fetch is still in flight. Only the fetches in flight are kept as futures or tasks; a finished fetch
+    leaves its plain result, and one that raised leaves nothing, so a later row fetches it again. A fetch that
+    returns a Future of its value (see process_frames_concurrently) leaves that Future as its result.
+
+    Args:
+        max_entries (Optional[int]): The number of results kept, the least recently used going first. Defaults
+            to None, which keeps the results of the whole run.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries
+        self.results: 'OrderedDict[str, Extracted]' = OrderedDict()
+        self.futures: Dict[str, Future] = {}
+        self.tasks: Dict[str, 'asyncio.Task'] = {}
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def _cached(self, key: str) -> Tuple[bool, Extracted]:
+        if key not in self.results:
+            return False, None
+        self.results.move_to_end(key)
+        self.duplicates += 1
+        return True, self.results[key]
+
+    def _remember(self, key: str, result: Extracted) -> None:
+        self.results[key] = result
+        if self.max_entries is not None and len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def run(self, url: str, fetch: Callable[..., Extracted], **kwargs) -> Extracted:
+        """
+        Returns fetch(url, **kwargs), or the result of the row that fetched the same canonical URL before.
+        """
+        key = normalize_url(url)
+        with self.lock:
+            found, result = self._cached(key)
+            future = self.futures.get(key)
+            owner = not found and future is None
+            if owner:
+                future = self.futures[key] = Future()
+            elif future is not None:
+                self.duplicates += 1
+        if found:
+            logging.info("Reusing the result of %s for %s", key, url, extra={'url': url})
+            return result
+        if not owner:
+            logging.info("Reusing the result of %s for %s", key, url, extra={'url': url})
+            return future.result()
+        try:
+            result = fetch(url, **kwargs)
+        except BaseException as e:
+            with self.lock:
+                del self.futures[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self._remember(key, result)
+            del self.futures[key]
+        future.set_result(result)
+        return result
+
+    async def async_run(self, url: str, fetch, **kwargs) -> Extracted:
+        """
+        Asyncio counterpart of run, for a coroutine function fetch.
+        """
+        key = normalize_url(url)
+        found, result = self._cached(key)
+        if found:
+            logging.info("Reusing the result of %s for %s", key, url, extra={'url': url})
+            return result
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(fetch(url, **kwargs))
+            task.add_done_callback(partial(self._task_done, key))
+        else:
+            self.duplicates += 1
+            logging.info("Reusing the result of %s for %s", key, url, extra={'url': url})
+        return await asyncio.shield(task)
+
+    def _task_done(self, key: str, task: 'asyncio.Task') -> None:
+        del self.tasks[key]
+        if not task.cancelled() and task.exception() is None:
+            self._remember(key, task.result())
+
+
+def _start_metrics(port: Optional[int], textfile: Optional[str], interval: float) -> Optional[Metrics]:
+    if port is None and not textfile:
+        return None
+    metrics = Metrics()
+    if port is not None:
+        metrics.serve(port)
+    if textfile:
+        metrics.write_textfile_every(textfile, interval)
+    return metrics
+
+
+def _run_rules(extraction_rules: Optional[Dict[str, Sequence[str]]],
+               keep_columns: Optional[List[str]]) -> ExtractionRules:
+    """
+    Compiles the extraction rules of a run, and rejects fields that would overwrite a kept input column.
+    """
+    rules = ExtractionRules(extraction_rules or DEFAULT_EXTRACTION_RULES)
+    clashing = [field for field in rules.fields if field in (keep_columns or ())]
+    if clashing:
+        raise ValueError(f"The fields {clashing} clash with columns in keep_columns. Rename them in the extraction "
+                         "rules.")
+    return rules
+
+
+class _RunResources(NamedTuple):
+    """
+    The state shared by the rows of a process_urls or async_process_urls run, see _run_resources.
+    """
+    rules: ExtractionRules
+    rate_limiter: Optional[HostRateLimiter]
+    retry_policy: RetryPolicy
+    stream: bool
+    checkpoint: Optional[Checkpoint]
+    response_cache: Optional[ResponseCache]
+    extraction_cache: Optional[ExtractionCache]
+    deduplicator: Optional[UrlDeduplicator]
+    parse_pool: Optional[ParsePool]
+    metrics: Optional[Metrics]
+    archive: Optional[ResponseArchive]
+    selector_stats: Optional[SelectorStats]
+    summary: _RunSummary
+
+
+@contextmanager
+def _run_resources(name: str, csv_filename: str, chunk_size: Optional[int], keep_columns: Optional[List[str]],
+                   requests_per_second: Optional[float], burst: int, adaptive_throttle: bool,
+                   max_requests_per_second: float, max_concurrency: int, retry_policy: Optional[RetryPolicy],
+                   stream: bool, checkpoint_filename: Optional[str], cache_dir: Optional[str], cache_ttl: float,
+                   extraction_cache_size: int, extraction_cache_path: Optional[str], dedupe_urls: bool,
+                   parse_workers: int, parse_queue_size: Optional[int], metrics_port: Optional[int],
+                   metrics_textfile: Optional[str], metrics_interval: float, archive_filename: Optional[str],
+                   extraction_rules: Optional[Dict[str, Sequence[str]]], learn_selector_order: bool,
+                   selector_stats_path: Optional[str]) -> Iterator[_RunResources]:
+    """
+    Sets up the state of a run from the arguments of process_urls or async_process_urls (named name in the log),
+    and logs the summary of the run at the end of the block. Everything opened is closed again, in reverse order,
+    also when the setup or the block raises, e.g. the metrics server frees its port and the parse workers exit. The
+    checkpoint of a run that raised is kept, so that the next run resumes from it.
+    """
+    rules = _run_rules(extraction_rules, keep_columns)
+    rate_limiter = create_rate_limiter(requests_per_second, burst, adaptive_throttle, max_requests_per_second,
+                                       max_concurrency)
+    retry_policy = retry_policy or RetryPolicy(max_retries=2, base_delay=5)
+    with ExitStack() as stack:
+        checkpoint = None
+        if checkpoint_filename and os.path.exists(csv_filename):
+            checkpoint = Checkpoint(checkpoint_filename, csv_filename)
+            stack.push(lambda exc_type, exc, traceback: checkpoint.close(finished=exc_type is None))
+        response_cache = ResponseCache(cache_dir, cache_ttl) if cache_dir else None
+        extraction_cache = None
+        if extraction_cache_size:
+            extraction_cache = ExtractionCache(extraction_cache_size, extraction_cache_path)
+            stack.callback(extraction_cache.close)
+
+        deduplicator = UrlDeduplicator(chunk_size) if dedupe_urls else None
+        parse_pool = stack.enter_context(ParsePool(parse_workers, parse_queue_size)) if parse_workers else None
+        metrics = _start_metrics(metrics_port, metrics_textfile, metrics_interval)
+        if metrics is not None:
+            stack.callback(metrics.close)
+        archive = None
+        if archive_filename:
+            archive = ResponseArchive(archive_filename)
+            stack.callback(archive.close)
+        selector_stats = None
+        if learn_selector_order:
+            selector_stats = SelectorStats(rules, selector_stats_path)
+            stack.callback(selector_stats.save)
+        if archive is not None and stream:
+            logging.warning("Streaming is disabled while archiving, the archive needs the whole pages")
+            stream = False
+        summary = _RunSummary()
+
+        yield _RunResources(rules, rate_limiter, retry_policy, stream, checkpoint, response_cache, extraction_cache,
+                            deduplicator, parse_pool, metrics, archive, selector_stats, summary)
+
+    if summary.rows:
+        summary.log(deduplicator.duplicates if deduplicator is not None else None)
+    else:
+        logging.error("DataFrame is empty, exiting %s.", name)
+
+
+def process_urls(csv_filename: str, output_csv_filename: str, random_sample: bool = False, sample_size: int = 100,
+                 max_workers: int = 1, pool_maxsize: Optional[int] = None,
+                 requests_per_second: Optional[float] = 0.5, burst: int = 1, adaptive_throttle: bool = False,
+                 max_requests_per_second: float = 10.0, retry_policy: Optional[RetryPolicy] = None,
+                 parser: str = 'html.parser', stream: bool = False, chunk_size: Optional[int] = None,
+                 keep_columns: Optional[List[str]] = None, output_format: Optional[str] = None,
+                 write_batch_size: int = 100, checkpoint_filename: Optional[str] = None,
+                 cache_dir: Optional[str] = None, cache_ttl: float = 86400, extraction_cache_size: int = 10000,
+                 extraction_cache_path: Optional[str] = None, dedupe_urls: bool = False, parse_workers: int = 0,
+                 parse_queue_size: Optional[int] = None, record_timings: bool = False,
+                 metrics_port: Optional[int] = None, metrics_textfile: Optional[str] = None,
+                 metrics_interval: float = 15, archive_filename: Optional[str] = None,
+                 extraction_rules: Optional[Dict[str, Sequence[str]]] = None, learn_selector_order: bool = False,
+                 selector_stats_path: Optional[str] = None) -> None:
+    """
+    Processes the supplied URLs from a CSV file, extracts the searched values, and saves the results to a new CSV file.
+
+    Args:
+        csv_filename (str): The name of the input CSV file.
+        output_csv_filename (str): The name of the output CSV file.
+        random_sample (bool): Whether to use a random sample of the data. Defaults to False.
+        sample_size (int): The size of the random sample to use. Defaults to 100.
+        max_workers (int): The number of URLs fetched concurrently. Defaults to 1.
+        pool_maxsize (Optional[int]): The number of keep-alive connections per host in the shared session. Defaults
+            to max_workers (at least 10).
+        requests_per_second (Optional[float]): The sustained request rate allowed per host. Defaults to 0.5, i.e. one
+            request every 2 seconds. None disables rate limiting.
+        burst (int): The number of requests a host may receive back to back before the rate applies. Defaults to 1.
+        adaptive_throttle (bool): Whether to adapt rate and concurrency per host to 403/429 responses and timeouts,
+            starting from requests_per_second. Defaults to False.
+        max_requests_per_second (float): The highest rate the adaptive throttle may reach per host. Defaults to 10.
+        retry_policy (Optional[RetryPolicy]): How failed requests are retried. Defaults to 2 retries with jittered
+            exponential backoff from 5 seconds.
+        parser (str): The parser backend, one of PARSER_BACKENDS. Defaults to 'html.parser'.
+        stream (bool): Whether to stream each page and stop downloading once the value is found. Defaults to False.
+        chunk_size (Optional[int]): If set, the input is read chunk_size rows at a time, and the next chunk is read
+            while the current one is fetched. Defaults to None, which loads the whole file first.
+        keep_columns (Optional[List[str]]): The input columns to load and copy to the output besides 'url'.
+            Defaults to all columns.
+        output_format (Optional[str]): 'csv' or 'jsonl'. Defaults to the format matching the output file extension.
+        write_batch_size (int): Results are appended to the output file, in input order, every time this many rows
+            are complete. Defaults to 100.
+        checkpoint_filename (Optional[str]): If set, completed rows are recorded in this file. A restarted run skips
+            them and writes their recorded results to the output. The file is removed once the run completes.
+            Defaults to None.
+        cache_dir (Optional[str]): If set, responses are cached in this directory and revalidated on later runs.
+            Defaults to None.
+        cache_ttl (float): The number of seconds a cached response is used without revalidation. Defaults to one day.
+        extraction_cache_size (int): The number of extracted values memoized by page content hash. 0 disables the
+            extraction cache. Defaults to 10000.
+        extraction_cache_path (Optional[str]): An SQLite file that keeps the extracted values across runs. Defaults
+            to None.
+        dedupe_urls (bool): Whether to fetch every canonical URL (see normalize_url) only once and copy its result
+            to all rows with the same canonical URL. With chunk_size, only the results of the last chunk_size
+            canonical URLs are kept, so memory stays bounded. Defaults to False.
+        parse_workers (int): The number of worker processes that parse the fetched pages, see ParsePool. Useful
+            with max_workers > 1, where parsing in the fetching threads is bound by the GIL. Defaults to 0, which
+            parses in the fetching thread.
+        parse_queue_size (Optional[int]): The number of fetched pages waiting for a parse worker before fetchers
+            block. Defaults to twice parse_workers.
+        record_timings (bool): Whether to add the RequestTiming.COLUMNS to the output: the milliseconds every row
+            spent queued, resolving, connecting, in the TLS handshake, waiting for the first byte, downloading,
+            parsing and in total, its number of attempts and the bytes received. Rows that were not fetched (skipped,
+            restored from the checkpoint or deduplicated) have no or zero timings. Defaults to False.
+        metrics_port (Optional[int]): If set, Prometheus metrics of the run (see Metrics) are served at
+            http://127.0.0.1:<metrics_port>/metrics. Defaults to None.
+        metrics_textfile (Optional[str]): If set, the metrics are written to this file every metrics_interval
+            seconds and at the end of the run, e.g. for the node_exporter textfile collector. Defaults to None.
+        metrics_interval (float): The number of seconds between rewrites of metrics_textfile. Defaults to 15.
+        archive_filename (Optional[str]): If set, every page downloaded in full is appended to this WARC archive
+            (see ResponseArchive), so its values can be re-extracted later without the network, see
+            reextract_archive. Disables stream. Defaults to None.
+        extraction_rules (Optional[Dict[str, Sequence[str]]]): The fields to extract from every page, each with the
+            selectors of the elements that may hold its value in order of preference, e.g.
+            {'results': ['span#sidebar-title', 'span[qaselector=sidebar-result-counter]'], 'title': ['h1#title']}.
+            Every field becomes an output column, and all of them are extracted from one parse of the page. A field
+            may not be named like a column in keep_columns or ExtractionRules.RESERVED_COLUMNS. The rules are
+            compiled once for the run, see ExtractionRules. Defaults to DEFAULT_EXTRACTION_RULES.
+        learn_selector_order (bool): Whether to learn for every host which of each field's selectors usually gives
+            the value, and try that one first on the host's pages, see SelectorStats. Saves parse time on large
+            homogeneous crawls, e.g. where most pages only have the fallback element, but a page holding several of
+            a field's elements may then get the value of a less preferred one. Defaults to False.
+        selector_stats_path (Optional[str]): A JSON file that keeps the learned selector counts across runs.
+            Defaults to None.
+    """
+    with _run_resources('process_urls', csv_filename, chunk_size=chunk_size, keep_columns=keep_columns,
+                        requests_per_second=requests_per_second, burst=burst, adaptive_throttle=adaptive_throttle,
+                        max_requests_per_second=max_requests_per_second, max_concurrency=max_workers,
+                        retry_policy=retry_policy, stream=stream, checkpoint_filename=checkpoint_filename,
+                        cache_dir=cache_dir, cache_ttl=cache_ttl, extraction_cache_size=extraction_cache_size,
+                        extraction_cache_path=extraction_cache_path, dedupe_urls=dedupe_urls,
+                        parse_workers=parse_workers, parse_queue_size=parse_queue_size, metrics_port=metrics_port,
+                        metrics_textfile=metrics_textfile, metrics_interval=metrics_interval,
+                        archive_filename=archive_filename, extraction_rules=extraction_rules,
+                        learn_selector_order=learn_selector_order, selector_stats_path=selector_stats_path) as run, \
+            create_session(pool_maxsize=pool_maxsize or max(max_workers, 10),
+                           record_timings=record_timings) as session, \
+            ResultWriter(output_csv_filename, output_format, write_batch_size) as writer:
+        # With a parse pool, fetch returns a Future of the value of a page that is still being parsed
+        fetch = partial(_extract, policy=run.retry_policy, metrics=run.metrics, session=session,
+                        rate_limiter=run.rate_limiter, parser=parser, stream=run.stream,
+                        response_cache=run.response_cache, extraction_cache=run.extraction_cache,
+                        parse_pool=run.parse_pool, archive=run.archive, rules=run.rules,
+                        selector_stats=run.selector_stats)
+        if run.deduplicator is not None:
+            fetch = partial(run.deduplicator.run, fetch=fetch)
+
+        pipeline = _FramePipeline(writer, run.checkpoint, record_timings, run.rules.fields, run.summary)
+        frames = _load_frames(csv_filename, random_sample, sample_size, chunk_size, keep_columns)
+        if max_workers > 1:
+            process_frames_concurrently(frames, pipeline, max_workers, fetch)
+        else:
+            for df in frames:
+                frame = pipeline.add(df)
+                for position in frame.pending:
+                    logging.info("Processing row %s:", frame.indexes[position] + 1,
+                                 extra={'url': frame.urls[position]})
+                    timing = frame.timings[position] if frame.timings is not None else None
+                    result = fetch(frame.urls[position], timing=timing)
+                    pipeline.complete(frame, position, result.result() if isinstance(result, Future) else result)
+
+
+def process_frames_concurrently(frames: Iterable[pd.DataFrame], pipeline: _FramePipeline, max_workers: int,
+                                fetch: Callable[..., Union[Extracted, Future]] = extract_value_from_url) -> None:
+    """
+    Fetches the rows of all input frames of a run using one bounded pool of worker threads.
+
+    At most twice max_workers requests are submitted at a time. The rows of the next frame are submitted as soon as
+    there is room, without waiting for the last rows of the frames before it. Every future is mapped back to the
+    frame and position it was submitted for, so the results land on the same rows as in the serial path regardless
+    of the order in which the requests complete. A fetch may return a Future of its value, e.g. for a page that is
+    still being parsed by a parse pool; the row then stays in flight until that is done, while the worker thread
+    goes on with the next row.
+
+    Args:
+        frames (Iterable[pd.DataFrame]): The input frames, see _load_frames.
+        pipeline (_FramePipeline): Receives the frames and the results of their rows.
+        max_workers (int): The maximum number of requests in flight at the same time.
+        fetch (Callable[..., Union[Extracted, Future]]): Returns the value for a URL, or a Future of it, and takes its
+            RequestTiming as `timing`. Defaults to extract_value_from_url; process_urls passes one with the session,
+            rate limiter, caches etc. of the run bound.
+    """
+    in_flight: Dict[Future, Tuple[_FrameResults, int]] = {}
+    completed = 0
+
+    def collect(return_when: str) -> None:
+        nonlocal completed
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            frame, position = in_flight.pop(future)
+            result = future.result()
+            if isinstance(result, Future):
+                # A Future shared by duplicate rows gets one per row, so that every row has its own key
+                in_flight[_then(result, Future.result)] = (frame, position)
+                continue
+            pipeline.complete(frame, position, result)
+            completed += 1
+            logging.info("Completed %s (%d requests done, %d in flight).", frame.urls[position], completed,
+                         len(in_flight), extra={'url': frame.urls[position]})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for df in frames:
+            frame = pipeline.add(df)
+            for position in frame.pending:
+                if len(in_flight) >= 2 * max_workers:
+                    collect(FIRST_COMPLETED)
+                timing = frame.timings[position] if frame.timings is not None else None
+                in_flight[executor.submit(fetch, frame.urls[position], timing=timing)] = (frame, position)
+        collect(ALL_COMPLETED)
+
+
+@asynccontextmanager
+async def _in_thread(manager):
+    """
+    Enters and exits a blocking context manager in a thread of the default executor, e.g. one that hashes or fsyncs a
+    file, so that the event loop is not held up meanwhile.
+    """
+    value = await asyncio.to_thread(manager.__enter__)
+    try:
+        yield value
+    except BaseException as exc:
+        if not await asyncio.to_thread(manager.__exit__, type(exc), exc, exc.__traceback__):
+            raise
+    else:
+        await asyncio.to_thread(manager.__exit__, None, None, None)
+
+
+async def async_process_urls(csv_filename: str, output_csv_filename: str, random_sample: bool = False,
+                             sample_size: int = 100, max_concurrency: int = 100,
+                             pool_maxsize: Optional[int] = None, requests_per_second: Optional[float] = 0.5,
+                             burst: int = 1, adaptive_throttle: bool = False,
+                             max_requests_per_second: float = 10.0, retry_policy: Optional[RetryPolicy] = None,
+                             parser: str = 'html.parser', stream: bool = False, chunk_size: Optional[int] = None,
+                             keep_columns: Optional[List[str]] = None, output_format: Optional[str] = None,
+                             write_batch_size: int = 100, checkpoint_filename: Optional[str] = None,
+                             cache_dir: Optional[str] = None, cache_ttl: float = 86400,
+                             extraction_cache_size: int = 10000, extraction_cache_path: Optional[str] = None,
+                             dedupe_urls: bool = False, parse_workers: int = 0,
+                             parse_queue_size: Optional[int] = None, record_timings: bool = False,
+                             metrics_port: Optional[int] = None, metrics_textfile: Optional[str] = None,
+                             metrics_interval: float = 15, archive_filename: Optional[str] = None,
+                             extraction_rules: Optional[Dict[str, Sequence[str]]] = None,
+                             learn_selector_order: bool = False,
+                             selector_stats_path: Optional[str] = None) -> None:
+    """
+    Asyncio counterpart of process_urls. All requests share one aiohttp session and at most max_concurrency of them
+    are in flight at the same time. Parsing and the file I/O of the run (reading the input, hashing it for the
+    checkpoint, writing the output and the caches) are done in threads of the default executor, so that the event
+    loop only waits for them.
+
+    Args:
+        csv_filename (str): The name of the input CSV file.
+        output_csv_filename (str): The name of the output CSV file.
+        random_sample (bool): Whether to use a random sample of the data. Defaults to False.
+        sample_size (int): The size of the random sample to use. Defaults to 100.
+        max_concurrency (int): The maximum number of requests in flight. Defaults to 100.
+        pool_maxsize (Optional[int]): The maximum number of connections per host. Defaults to no per-host limit.
+        requests_per_second (Optional[float]): The sustained request rate allowed per host. Defaults to 0.5. None
+            disables rate limiting.
+        burst (int): The number of requests a host may receive back to back before the rate applies. Defaults to 1.
+        adaptive_throttle (bool): Whether to adapt rate and concurrency per host to 403/429 responses and timeouts,
+            starting from requests_per_second. Defaults to False.
+        max_requests_per_second (float): The highest rate the adaptive throttle may reach per host. Defaults to 10.
+        retry_policy (Optional[RetryPolicy]): How failed requests are retried. Defaults to 2 retries with jittered
+            exponential backoff from 5 seconds.
+        parser (str): The parser backend, one of PARSER_BACKENDS. Defaults to 'html.parser'.
+        stream (bool): Whether to stream each page and stop downloading once the value is found. Defaults to False.
+        chunk_size (Optional[int]): If set, the input is read chunk_size rows at a time, see process_urls.
+        keep_columns (Optional[List[str]]): The input columns to load and copy to the output besides 'url'.
+        output_format (Optional[str]): 'csv' or 'jsonl'. Defaults to the format matching the output file extension.
+        write_batch_size (int): The number of complete rows appended to the output file at a time. Defaults to 100.
+        checkpoint_filename (Optional[str]): If set, completed rows are recorded in this file so that a restarted
+            run can skip them, see process_urls.
+        cache_dir (Optional[str]): If set, responses are cached in this directory and revalidated on later runs.
+        cache_ttl (float): The number of seconds a cached response is used without revalidation. Defaults to one day.
+        extraction_cache_size (int): The number of extracted values memoized by page content hash. 0 disables the
+            extraction cache. Defaults to 10000.
+        extraction_cache_path (Optional[str]): An SQLite file that keeps the extracted values across runs.
+        dedupe_urls (bool): Whether to fetch every canonical URL only once, see process_urls.
+        parse_workers (int): The number of worker processes that parse the fetched pages, see ParsePool. Defaults
+            to 0, which parses in threads of the default executor.
+        parse_queue_size (Optional[int]): The number of fetched pages waiting for a parse worker. Defaults to twice
+            parse_workers.
+        record_timings (bool): Whether to add the RequestTiming.COLUMNS to the output, see process_urls. The TLS
+            handshake is counted as connect.
+        metrics_port (Optional[int]): If set, Prometheus metrics of the run are served on this port, see
+            process_urls.
+        metrics_textfile (Optional[str]): If set, the metrics are written to this file periodically.
+        metrics_interval (float): The number of seconds between rewrites of metrics_textfile. Defaults to 15.
+        archive_filename (Optional[str]): If set, every page downloaded in full is appended to this WARC archive,
+            see process_urls.
+        extraction_rules (Optional[Dict[str, Sequence[str]]]): The fields to extract from every page and their
+            selectors, see process_urls. Defaults to DEFAULT_EXTRACTION_RULES.
+        learn_selector_order (bool): Whether to try the selector that usually gives the value on a host first, see
+            process_urls. Defaults to False.
+        selector_stats_path (Optional[str]): A JSON file that keeps the learned selector counts across runs.
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for the asyncio API. Install it with 'pip install aiohttp'.")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_limited(run: _RunResources, url: str, session: 'aiohttp.ClientSession',
+                            timing: Optional[RequestTiming] = None) -> Extracted:
+        async with semaphore:
+            return await async_extract_value_from_url(url, session, rate_limiter=run.rate_limiter,
+                                                      retry_policy=run.retry_policy, parser=parser, stream=run.stream,
+                                                      response_cache=run.response_cache,
+                                                      extraction_cache=run.extraction_cache,
+                                                      parse_pool=run.parse_pool, timing=timing, metrics=run.metrics,
+                                                      archive=run.archive, rules=run.rules,
+                                                      selector_stats=run.selector_stats)
+
+    async def fetch(run: _RunResources, frame: _FrameResults, position: int,
+                    session: 'aiohttp.ClientSession') -> Extracted:
+        url = frame.urls[position]
+        timing = frame.timings[position] if frame.timings is not None else None
+        if run.deduplicator is not None:
+            return await run.deduplicator.async_run(url, partial(fetch_limited, run, session=session),
+                                                    timing=timing)
+        return await fetch_limited(run, url, session, timing)
+
+    def complete(pipeline: _FramePipeline, completed: List[Tuple[_FrameResults, int, Extracted]]) -> None:
+        for frame, position, result in completed:
+            pipeline.complete(frame, position, result)
+
+    async def collect(pipeline: _FramePipeline, in_flight: Dict['asyncio.Task', Tuple[_FrameResults, int]],
+                      return_when: str) -> None:
+        done, _ = await asyncio.wait(in_flight, return_when=return_when)
+        completed = [(*in_flight.pop(task), task.result()) for task in done]
+        # Completing rows writes and fsyncs the output and the checkpoint, so it is done in a thread. The pipeline is
+        # only ever used by one thread at a time, as this coroutine waits for it
+        await asyncio.to_thread(complete, pipeline, completed)
+
+    resources = _run_resources('async_process_urls', csv_filename, chunk_size=chunk_size, keep_columns=keep_columns,
+                               requests_per_second=requests_per_second, burst=burst,
+                               adaptive_throttle=adaptive_throttle, max_requests_per_second=max_requests_per_second,
+                               max_concurrency=max_concurrency, retry_policy=retry_policy, stream=stream,
+                               checkpoint_filename=checkpoint_filename, cache_dir=cache_dir, cache_ttl=cache_ttl,
+                               extraction_cache_size=extraction_cache_size,
+                               extraction_cache_path=extraction_cache_path, dedupe_urls=dedupe_urls,
+                               parse_workers=parse_workers, parse_queue_size=parse_queue_size,
+                               metrics_port=metrics_port, metrics_textfile=metrics_textfile,
+                               metrics_interval=metrics_interval, archive_filename=archive_filename,
+                               extraction_rules=extraction_rules, learn_selector_order=learn_selector_order,
+                               selector_stats_path=selector_stats_path)
+    async with _in_thread(resources) as run:
+        connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=pool_maxsize or 0)
+        trace_configs = [_timing_trace_config()] if record_timings else None
+        async with aiohttp.ClientSession(headers=DEFAULT_HEADERS, connector=connector,
+                                         trace_configs=trace_configs) as session:
+            async with _in_thread(ResultWriter(output_csv_filename, output_format, write_batch_size)) as writer:
+                pipeline = _FramePipeline(writer, run.checkpoint, record_timings, run.rules.fields, run.summary)
+                # One pool of tasks for the whole run: the rows of the next frame start as soon as there is room,
+                # without waiting for the last rows of the frames before it
+                in_flight: Dict[asyncio.Task, Tuple[_FrameResults, int]] = {}
+                frames = await asyncio.to_thread(_load_frames, csv_filename, random_sample, sample_size, chunk_size,
+                                                 keep_columns)
+                while True:
+                    # Waiting for a chunk, or reading the whole file, must not block the event loop
+                    df = await asyncio.to_thread(next, frames, None)
+                    if df is None:
+                        break
+                    frame = await asyncio.to_thread(pipeline.add, df)
+                    for position in frame.pending:
+                        if len(in_flight) >= 2 * max_concurrency:
+                            await collect(pipeline, in_flight, asyncio.FIRST_COMPLETED)
+                        in_flight[asyncio.ensure_future(fetch(run, frame, position, session))] = (frame, position)
+                if in_flight:
+                    await collect(pipeline, in_flight, asyncio.ALL_COMPLETED)
+
+
+def _parse_archived_batch(pages: List[Tuple[bytes, Optional[str]]], parser: str,
+                          rules: ExtractionRules) -> List[Tuple[Match, ...]]:
+    return [_parse_body(body, encoding, parser, rules) for body, encoding in pages]
+
+
+def reextract_archive(archive_filename: str, output_csv_filename: str, parser: str = 'html.parser',
+                      parse_workers: Optional[int] = None, batch_size: int = 100,
+                      output_format: Optional[str] = None, write_batch_size: int = 1000,
+                      extraction_rules: Optional[Dict[str, Sequence[str]]] = None) -> int:
+    """
+    Extracts the values again from the pages of a ResponseArchive, without any network access, e.g. after the site
+    changed its markup or a selector was added. The pages are parsed in batches by a pool of worker processes, with
+    a bounded number of batches in flight, and the output rows are written in archive order.
+
+    Args:
+        archive_filename (str): The archive written by process_urls(archive_filename=...).
+        output_csv_filename (str): The output file, with the columns url, archived_at and one per extracted field.
+        parser (str): The parser backend, one of PARSER_BACKENDS. Defaults to 'html.parser'.
+        parse_workers (Optional[int]): The number of worker processes. Defaults to the number of CPUs.
+        batch_size (int): The number of pages sent to a worker at a time. Defaults to 100.
+        output_format (Optional[str]): 'csv' or 'jsonl'. Defaults to the format matching the output file extension.
+        write_batch_size (int): The number of rows appended to the output file at a time. Defaults to 1000.
+        extraction_rules (Optional[Dict[str, Sequence[str]]]): The fields to extract and their selectors, see
+            process_urls. Defaults to DEFAULT_EXTRACTION_RULES.
+
+    Returns:
+        int: The number of pages re-extracted.
+    """
+    rules = ExtractionRules(extraction_rules or DEFAULT_EXTRACTION_RULES)
+    parse_matches_from_html('', parser, rules)  # fail on an unknown parser before starting the pool
+    workers = parse_workers or os.cpu_count() or 1
+    records = ResponseArchive.read(archive_filename)
+    in_flight = deque()
+    pages = 0
+
+    def write_oldest():
+        batch, future = in_flight.popleft()
+        matches = future.result()
+        columns = {field: [page[index][0] for page in matches] for index, field in enumerate(rules.fields)}
+        writer.write(pd.DataFrame({'url': [record.url for record in batch],
+                                   'archived_at': [record.date for record in batch], **columns}))
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor, \
+            ResultWriter(output_csv_filename, output_format, write_batch_size) as writer:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            in_flight.append((batch, executor.submit(_parse_archived_batch,
+                                                     [(record.body, record.encoding) for record in batch], parser,
+                                                     rules)))
+            pages += len(batch)
+            if len(in_flight) >= 2 * workers:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+
+    logging.info(f"Re-extracted {pages} pages from {archive_filename}")
+    return pages
+
+
+def main(payload: dict) -> None:
+    """
+    Main function to execute the data processing workflow.
+
+    Args:
+        payload (dict): A dictionary containing the configuration parameters.
+    """
+    with configured_logging(payload.get('log_format', 'text'), payload.get('log_level', 'INFO'),
+                            payload.get('log_sample_rate', 1.0), payload.get('log_file')):
+        _run(payload)
+
+
+def _run(payload: dict) -> None:
+    try:
+        if payload.get('mode') == 'reextract':
+            reextract_archive(
+                payload['archive_filename'],
+                payload['output_csv_filename'],
+                parser=payload.get('parser', 'html.parser'),
+                parse_workers=payload.get('parse_workers') or None,
+                output_format=payload.get('output_format'),
+                extraction_rules=payload.get('extraction_rules')
+            )
+            return
+        retry_policy = RetryPolicy(
+            max_retries=payload.get('max_retries', 2),
+            base_delay=payload.get('retry_delay', 5),
+            max_delay=payload.get('max_retry_delay', 60)
+        )
+        options = dict(
+            pool_maxsize=payload.get('pool_maxsize'),
+            requests_per_second=payload.get('requests_per_second', 0.5),
+            burst=payload.get('burst', 1),
+            adaptive_throttle=payload.get('adaptive_throttle', False),
+            max_requests_per_second=payload.get('max_requests_per_second', 10.0),
+            retry_policy=retry_policy,
+            parser=payload.get('parser', 'html.parser'),
+            stream=payload.get('stream', False),
+            chunk_size=payload.get('chunk_size'),
+            keep_columns=payload.get('keep_columns'),
+            output_format=payload.get('output_format'),
+            write_batch_size=payload.get('write_batch_size', 100),
+            checkpoint_filename=payload.get('checkpoint_filename'),
+            cache_dir=payload.get('cache_dir'),
+            cache_ttl=payload.get('cache_ttl', 86400),
+            extraction_cache_size=payload.get('extraction_cache_size', 10000),
+            extraction_cache_path=payload.get('extraction_cache_path'),
+            dedupe_urls=payload.get('dedupe_urls', False),
+            parse_workers=payload.get('parse_workers', 0),
+            parse_queue_size=payload.get('parse_queue_size'),
+            record_timings=payload.get('record_timings', False),
+            metrics_port=payload.get('metrics_port'),
+            metrics_textfile=payload.get('metrics_textfile'),
+            metrics_interval=payload.get('metrics_interval', 15),
+            archive_filename=payload.get('archive_filename'),
+            extraction_rules=payload.get('extraction_rules'),
+            learn_selector_order=payload.get('learn_selector_order', False),
+            selector_stats_path=payload.get('selector_stats_path')
+        )
+        args = (payload['csv_filename'], payload['output_csv_filename'], payload['random_sample'],
+                payload['sample_size'])
+        if payload.get('engine', 'sync') == 'async':
+            asyncio.run(async_process_urls(*args, max_concurrency=payload.get('max_workers', 100), **options))
+        else:
+            process_urls(*args, max_workers=payload.get('max_workers', 1), **options)
     except KeyError as e:
         logging.error(f"Missing key in payload: {e}")
     except Exception as e:
@@ -195,9 +3532,43 @@ def main(payload: dict) -> None:
 
 if __name__ == '__main__':
     Payload = {
+        'mode': 'fetch',
         'csv_filename': 'test.csv',
         'output_csv_filename': 'test_results.csv',
         'random_sample': False,
-        'sample_size': 100
+        'sample_size': 100,
+        'max_workers': 1,
+        'engine': 'sync',
+        'requests_per_second': 0.5,
+        'burst': 1,
+        'adaptive_throttle': False,
+        'max_retries': 2,
+        'retry_delay': 5,
+        'max_retry_delay': 60,
+        'parser': 'html.parser',
+        'stream': False,
+        'chunk_size': None,
+        'keep_columns': None,
+        'output_format': None,
+        'write_batch_size': 100,
+        'checkpoint_filename': 'test_results.checkpoint',
+        'cache_dir': None,
+        'cache_ttl': 86400,
+        'extraction_cache_size': 10000,
+        'extraction_cache_path': None,
+        'dedupe_urls': False,
+        'parse_workers': 0,
+        'parse_queue_size': None,
+        'record_timings': False,
+        'metrics_port': None,
+        'metrics_textfile': None,
+        'log_format': 'text',
+        'log_level': 'INFO',
+        'log_sample_rate': 1.0,
+        'log_file': None,
+        'archive_filename': None,
+        'extraction_rules': None,
+        'learn_selector_order': False,
+        'selector_stats_path': None
     }
     main(Payload)
@@ -0,0 +1,105 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scr'))
+
+from scrape_data import Checkpoint  # noqa: E402
+
+URLS = np.array(['https://example.com/a', 'https://example.com/b', 'https://example.com/c'], dtype=object)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.directory = tempfile.mkdtemp()
+        self.input_filename = os.path.join(self.directory, 'urls.csv')
+        self.filename = os.path.join(self.directory, 'checkpoint.jsonl')
+        self.write_input('url\n' + '\n'.join(URLS) + '\n')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.directory)
+
+    def write_input(self, content: str) -> None:
+        with open(self.input_filename, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def restore(self, checkpoint: Checkpoint, urls: np.ndarray = URLS):
+        results = np.full(len(urls), None, dtype=object)
+        return checkpoint.restore(range(len(urls)), urls, results), results
+
+    def test_resume_restores_recorded_rows(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], '12 results')
+        checkpoint.record(2, URLS[2], {'results': None, 'other': 'x'})
+        checkpoint.close()
+
+        resumed = Checkpoint(self.filename, self.input_filename)
+        restored, results = self.restore(resumed)
+        resumed.close()
+        self.assertEqual(list(restored), [True, False, True])
+        self.assertEqual(list(results), ['12 results', None, {'results': None, 'other': 'x'}])
+
+    def test_errors_are_not_recorded(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], 'HTTP Error: 500 (Attempt 3)')
+        checkpoint.record(1, URLS[1], 'Request Timeout')
+        checkpoint.record(2, URLS[2], None)
+        checkpoint.close()
+
+        resumed = Checkpoint(self.filename, self.input_filename)
+        restored, _ = self.restore(resumed)
+        resumed.close()
+        self.assertEqual(list(restored), [False, False, True])
+
+    def test_row_with_another_url_is_not_restored(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], 'value')
+        checkpoint.close()
+
+        resumed = Checkpoint(self.filename, self.input_filename)
+        restored, _ = self.restore(resumed, np.array(['https://example.com/other'], dtype=object))
+        resumed.close()
+        self.assertFalse(restored.any())
+
+    def test_line_cut_short_by_a_crash_is_skipped(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], 'value')
+        checkpoint.close()
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write('{"row": 1, "url": "https://exa')
+
+        resumed = Checkpoint(self.filename, self.input_filename)
+        restored, _ = self.restore(resumed)
+        resumed.close()
+        self.assertEqual(list(restored), [True, False, False])
+
+    def test_different_input_starts_from_scratch(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], 'value')
+        checkpoint.close()
+        self.write_input('url\nhttps://example.com/a\n')
+
+        resumed = Checkpoint(self.filename, self.input_filename)
+        restored, _ = self.restore(resumed)
+        resumed.close()
+        self.assertFalse(restored.any())
+        with open(self.filename, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 1)  # only the header of the new input
+
+    def test_finished_run_removes_the_checkpoint(self):
+        checkpoint = Checkpoint(self.filename, self.input_filename)
+        checkpoint.record(0, URLS[0], 'value')
+        checkpoint.close(finished=True)
+        self.assertFalse(os.path.exists(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
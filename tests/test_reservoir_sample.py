@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scr'))
+
+from scrape_data import reservoir_sample  # noqa: E402
+
+
+def chunked(rows: int, chunk_size: int):
+    df = pd.DataFrame({'url': [f'https://example.com/{n}' for n in range(rows)], 'n': range(rows)})
+    return [df.iloc[start:start + chunk_size] for start in range(0, rows, chunk_size)]
+
+
+class ReservoirSampleTest(unittest.TestCase):
+
+    def test_fewer_rows_than_sample_size_returns_all_rows(self):
+        sample = reservoir_sample(chunked(7, 3), sample_size=10)
+        self.assertEqual(sorted(sample['n']), list(range(7)))
+        self.assertEqual(list(sample.index), list(range(7)))
+
+    def test_sample_size_and_fresh_index(self):
+        sample = reservoir_sample(chunked(50, 8), sample_size=5, seed=3)
+        self.assertEqual(len(sample), 5)
+        self.assertEqual(sample['n'].nunique(), 5)
+        self.assertEqual(list(sample.index), list(range(5)))
+
+    def test_same_seed_gives_same_sample(self):
+        first = reservoir_sample(chunked(50, 8), sample_size=5, seed=7)
+        second = reservoir_sample(chunked(50, 8), sample_size=5, seed=7)
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_every_row_is_equally_likely(self):
+        rows, sample_size, runs = 20, 5, 1000
+        counts = pd.Series(0, index=range(rows))
+        for seed in range(runs):
+            counts[reservoir_sample(chunked(rows, 3), sample_size, seed=seed)['n']] += 1
+        # Each row is expected in runs * sample_size / rows = 250 samples, with a standard deviation of about 14
+        expected = runs * sample_size / rows
+        for row, count in counts.items():
+            self.assertLess(abs(count - expected), 60, f"row {row} was sampled {count} times")
+
+
+if __name__ == '__main__':
+    unittest.main()
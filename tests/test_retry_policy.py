@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import unittest
+from email.utils import formatdate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scr'))
+
+from scrape_data import RetryPolicy, _parse_retry_after  # noqa: E402
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_should_retry_until_attempts_run_out(self):
+        policy = RetryPolicy(max_retries=2)
+        self.assertTrue(policy.should_retry(0))
+        self.assertTrue(policy.should_retry(1, 503))
+        self.assertFalse(policy.should_retry(2))
+        self.assertFalse(policy.should_retry(2, 503))
+
+    def test_only_listed_status_codes_are_retried(self):
+        policy = RetryPolicy(max_retries=3)
+        for status_code in (403, 429, 500, 502, 503, 504):
+            self.assertTrue(policy.should_retry(0, status_code), status_code)
+        for status_code in (400, 401, 404, 410):
+            self.assertFalse(policy.should_retry(0, status_code), status_code)
+
+    def test_delay_without_jitter_doubles_up_to_max_delay(self):
+        policy = RetryPolicy(base_delay=2, max_delay=10, jitter=False)
+        self.assertEqual([policy.delay(attempt) for attempt in range(5)], [2, 4, 8, 10, 10])
+
+    def test_jittered_delay_stays_between_zero_and_the_ceiling(self):
+        policy = RetryPolicy(base_delay=1, max_delay=20)
+        for attempt in range(7):
+            ceiling = min(20, 2 ** attempt)
+            delays = [policy.delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= ceiling for delay in delays), attempt)
+            # Full jitter spreads the delays over the whole range
+            self.assertLess(min(delays), ceiling / 4)
+            self.assertGreater(max(delays), ceiling * 3 / 4)
+
+    def test_retry_after_seconds_take_precedence_for_429_and_503(self):
+        policy = RetryPolicy(base_delay=1, max_delay=60)
+        self.assertEqual(policy.delay(0, 429, '30'), 30)
+        self.assertEqual(policy.delay(3, 503, '0'), 0)
+
+    def test_retry_after_is_capped_at_max_delay(self):
+        self.assertEqual(RetryPolicy(max_delay=60).delay(0, 429, '3600'), 60)
+
+    def test_retry_after_is_ignored_for_other_status_codes(self):
+        policy = RetryPolicy(base_delay=1, max_delay=60, jitter=False)
+        self.assertEqual(policy.delay(0, 500, '30'), 1)
+
+    def test_invalid_retry_after_falls_back_to_backoff(self):
+        policy = RetryPolicy(base_delay=4, max_delay=60, jitter=False)
+        self.assertEqual(policy.delay(1, 429, 'soon'), 8)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(_parse_retry_after('120'), 120)
+        self.assertEqual(_parse_retry_after('-5'), 0)
+        self.assertIsNone(_parse_retry_after('soon'))
+        in_a_minute = _parse_retry_after(formatdate(time.time() + 60, usegmt=True))
+        self.assertTrue(55 <= in_a_minute <= 60, in_a_minute)
+        self.assertEqual(_parse_retry_after(formatdate(time.time() - 60, usegmt=True)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
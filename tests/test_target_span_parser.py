@@ -0,0 +1,70 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scr'))
+
+from scrape_data import _DEFAULT_RULES, TargetSpanParser, parse_matches_from_html  # noqa: E402
+
+# Fragments that are combined into pages, chosen for the places where a targeted parse can go wrong: misnested and
+# unclosed elements, void elements, selected elements in comments and scripts, and case and quoting of attributes
+TOKENS = ['<span id="sidebar-title">', '<span qaselector="sidebar-result-counter">', '<span>', '</span>', '<div>',
+          '</div>', '<p>', '</p>', '<b>', '</b>', '<br>', '<br/>', '<img src=x>', '</br>', 'text', '  more ', '&amp;',
+          '<!-- c <span id="sidebar-title">C</span> -->', '<script>"<span id=\\"sidebar-title\\">S</span>"</script>',
+          '<style>p{}</style>', '<span/>', '<i>', '<SPAN ID="sidebar-title">', '</SPAN >', '<span id=sidebar-title>',
+          '<!-->', '<div id="sidebar-title">', '</i>', '<table><tr><td>']
+
+
+def feed_in_chunks(html: str, chunk_size: int):
+    parser = TargetSpanParser(_DEFAULT_RULES.selectors, _DEFAULT_RULES.preferred)
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+    parser.close()
+    return _DEFAULT_RULES.resolve(parser.found.get)
+
+
+class TargetSpanParserTest(unittest.TestCase):
+
+    def assertSameAsHtmlParser(self, html: str) -> None:
+        expected = parse_matches_from_html(html, 'html.parser')
+        self.assertEqual(parse_matches_from_html(html, 'targeted'), expected, html)
+        for chunk_size in (1, 5, 64):
+            self.assertEqual(feed_in_chunks(html, chunk_size), expected, (html, chunk_size))
+
+    def test_primary_element(self):
+        self.assertSameAsHtmlParser('<html><body><span id="sidebar-title"> 12 <b>risultati</b></span></body></html>')
+
+    def test_fallback_element(self):
+        self.assertSameAsHtmlParser('<div><span qaselector="sidebar-result-counter">7 res</span></div>')
+
+    def test_missing_element(self):
+        self.assertSameAsHtmlParser('<div><span class="other">nothing</span></div>')
+        self.assertSameAsHtmlParser('')
+
+    def test_elements_in_comments_and_scripts_are_ignored(self):
+        self.assertSameAsHtmlParser('<!-- <span id="sidebar-title">old</span> --><span id="sidebar-title">new</span>')
+        self.assertSameAsHtmlParser('<script>var s = "<span id=\\"sidebar-title\\">x</span>";</script>')
+
+    def test_unclosed_and_misnested_elements(self):
+        self.assertSameAsHtmlParser('<span id="sidebar-title">12<span>inner</div> tail')
+        self.assertSameAsHtmlParser('<p><span id="sidebar-title">12</p>after</span>')
+
+    def test_character_references(self):
+        self.assertSameAsHtmlParser('<span id="sidebar-title">12 &amp; more&nbsp;&#233;</span>')
+
+    def test_random_pages(self):
+        rnd = random.Random(20240601)
+        for _ in range(3000):
+            html = ''.join(rnd.choice(TOKENS) for _ in range(rnd.randint(1, 14)))
+            self.assertSameAsHtmlParser(html)
+
+    def test_done_once_the_preferred_element_is_complete(self):
+        parser = TargetSpanParser(_DEFAULT_RULES.selectors, _DEFAULT_RULES.preferred)
+        parser.feed('<div><span id="sidebar-title">12</span>')
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.found[0], '12')
+
+
+if __name__ == '__main__':
+    unittest.main()